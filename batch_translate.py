@@ -6,41 +6,320 @@ batch_translate.py
 
 使用方法：
 1. 确保已安装所需的库：
-   - pandas
    - argostranslate
    - tqdm
 
 2. 在命令行中运行脚本：
-   python batch_translate.py <输入文件路径> [--from_lang <源语言代码>] [--to_lang <目标语言代码>] [--threads <线程数>] [--batch_size <每批处理的单词数>] [--use_mp]
+   python batch_translate.py <输入文件路径> [<更多输入文件> ...] [--from_lang <源语言代码>] [--to_lang <目标语言代码>[,<更多目标语言>]] [--output_layout files|wide] [--output_format csv|jsonl|parquet|flashcard] [--pivot_lang <中间语言>] [--shard <i/N>] [--metrics_trace <明细文件>] [--metrics_prom <指标文件>] [--column <列名>] [--stream] [--chunk_size <每块单词数>] [--reorder_window <单词数>] [--threads <线程数>] [--batch_size <每批处理的单词数>] [--token_budget <每批 token 预算>] [--use_mp | --async] [--device auto|cpu|cuda] [--pin_cpus] [--max_memory <内存预算>] [--worker_max_rss <单进程上限>] [--max_tasks_per_worker <批次数>] [--refresh_env] [--persistent_pool] [--compact_every <压缩间隔>] [--normalize <规则列表>] [--glossary <术语表>] [--keep_acronyms] [--backend <翻译后端>] [--serve <地址:端口>] [--auto] [--recalibrate] [--cache_file <缓存文件路径>] [--no_cache] [--fuzzy_policy off|hint|reuse] [--fuzzy_threshold <相似度>]
 
    示例：
    python batch_translate.py words.txt --from_lang en --to_lang zh --threads 4 --batch_size 20 --use_mp
+   python batch_translate.py glossary.txt --to_lang zh,ja,de --output_layout wide --use_mp
+   python batch_translate.py corpus.jsonl.gz --column text --stream --use_mp
+   python batch_translate.py --serve 0.0.0.0:5000
+   python batch_translate.py corpus.txt --shard 0/4 （在各台机器上分别运行 0/4 到 3/4）
+   python batch_translate.py merge corpus.txt --shards 4
+   python batch_translate.py words.txt --backend libretranslate:url=http://translate-box:5000 --threads 16
 
 参数说明：
-- <输入文件路径>：包含待翻译单词的文本文件路径。
+- <输入文件路径>：包含待翻译单词的文件路径，可以一次指定多个文件，依次翻译。按扩展名识别格式：
+  纯文本每行一个单词；.csv/.tsv 取 --column 指定的列；.jsonl/.ndjson 取 --column 指定的字段；
+  以上格式都可以再用 gzip 压缩（例如 words.txt.gz、corpus.jsonl.gz），读取时边解压边处理。
+- --metrics_trace：把每批的性能明细追加写入该 JSONL 文件：各阶段耗时（queue_wait 排队、cache_read 读缓存、
+  tokenize 分词、inference 模型推理或 HTTP 请求、detokenize 还原文本、cache_write 写缓存、write 写结果）
+  和事件计数（model_calls 后端调用、bisect_splits 出错后二分重试、mismatches 结果数量不匹配、retries 临时错误重试、
+  failed_items 失败条目、cache_hits 缓存命中）。
+- --metrics_prom：Prometheus 文本格式的指标文件（各阶段耗时直方图和事件计数），运行期间每隔 --metrics_interval 秒
+  （默认 10）原子地刷新一次，可以交给 node_exporter 的 textfile collector 采集。
+  指定以上任一选项时，结束时还会打印各阶段的耗时占比，用来判断时间花在模型、二分重试还是 I/O 上。
+- --shard：分片运行，格式为 i/N（i 从 0 开始）。按条目文本的稳定哈希把输入分成 N 份，只翻译其中第 i 份，
+  各分片互不重叠，可以在多台机器或多个容器上分别运行同一份输入，不需要协调服务。分片的输出文件名带有
+  .shard-i-of-N，旁边的 <输出文件>.manifest.json 记录分片的完成状态（running/complete/incomplete）。
+- merge 子命令：python batch_translate.py merge <输入文件> --shards N [--from_lang ..] [--to_lang ..]
+  [--output_format ..] [--column ..] [--allow_partial]。检查各分片的清单，按输入顺序把分片输出合并成
+  最终文件，并核对每个输入条目都有译文；有缺失时报告缺少译文的分片和条目，不生成结果（除非指定 --allow_partial）。
+- --column：CSV/TSV 输入的列名或从 0 开始的列序号（第一行为表头，默认第一列），JSONL 输入的字段名（默认 text）。
+- --stream：流式处理超大的输入。按 --chunk_size 分块读取，结果经重排缓冲区按输入顺序追加到输出：某一行之前的
+  所有行都完成后立即写出，不等整块完成，下游可以用 tail -f 跟着读取（parquet 格式仍在每块完成时写出一个分片）。
+  每块完成后落盘并在 <输出文件>.progress 中记录进度，内存占用只与块大小和乱序窗口有关。中断后再次运行从上次提交的块
+  之后继续，输出中上次提交之后写出的行会被截掉重写。
+  流式模式下失败的条目只记录在失败报告中，不会在下次运行时自动重试；不支持 --output_layout wide。
+- --chunk_size：流式处理时每块的单词数，默认为 50000。
+- --reorder_window：流式处理时每多少个单词单独按长度分桶组批，默认为 2000。批次大体按输入顺序调度，
+  输出可以在整块完成之前持续增长，乱序窗口（以及重排缓冲区的内存占用）与该值相当；0 表示整块一起分桶，组批最优但要等
+  块内大部分批次完成后才能写出。
 - --from_lang：源语言代码，默认为 'en'（英语）。
-- --to_lang：目标语言代码，默认为 'zh'（中文）。
+- --to_lang：目标语言代码，默认为 'zh'（中文）。可以用逗号指定多个目标语言（例如 zh,ja,de），
+  一次运行完成：输入只读取一次，规范化去重只做一次，各语言依次使用同一个进程池；切换语言时每个进程先释放
+  上一个语言的模型再加载下一个，同一时间只占用一个模型的内存。多个输入文件时按语言依次翻译所有文件，
+  每个语言的模型只加载一次（各文件的条目同时驻留内存；流式模式仍按文件、按块依次处理各语言）；
+  每种语言单独续跑，结果分别保存为 translated_<输入文件名>_<源语言>_to_<目标语言>.csv。
+- --output_layout：多个目标语言时的输出格式，files（默认，每种语言一个文件）或 wide（另外把各语言的结果
+  合并成一个宽表 translated_<输入文件名>_<源语言>_to_zh-ja-de.csv，原文一列、每种语言一列；
+  各语言的单独文件保留，用于续跑）。
+- --output_format：输出格式，默认为 csv（带 BOM 的 UTF-8，表头为 原文,翻译）。可选：
+  jsonl（每行一个 {"source": .., "translation": ..}）；
+  parquet（source、translation 两列，需要安装 pyarrow；普通模式为单个文件，--stream 模式下为目录，
+  每块追加一个分片，可以直接用 pandas/DuckDB 等按列查询，不必读入整个文件）；
+  flashcard（闪卡导入格式：每行 "原文<Tab>译文"，无表头，可直接导入 Anki 等背单词应用）。
+  续跑时只读取输出中的原文列。宽表（--output_layout wide）总是 CSV。
+- --pivot_lang：argos 后端下某个语言对没有直接的翻译包时，经这个中间语言中转翻译（两段的翻译包都会自动安装），
+  默认为 'en'。第一段（源语言 → 中间语言）的结果进入该语言对的缓存，经同一中间语言的多个目标语言
+  （例如 --from_lang ja --to_lang zh,ko）只翻译一次第一段。
 - --threads：使用的线程数，默认为 4。
-- --batch_size：每批处理的单词数，默认为 20。
-- --use_mp：使用多进程而非多线程。
+- --batch_size：每批处理的单词数上限，默认为 20。
+- --token_budget：每批的 token 预算（按批内最长条目 × 条目数计算，即包含填充的解码代价），默认为 160。
+  输入会先按估算长度分桶，长度相近的条目组成同一批，输出时恢复原始顺序。
+- --use_mp：使用多进程而非多线程。每个工作进程启动时加载一次翻译模型并常驻。进程池启动后打印主进程和每个工作进程
+  加载模型后的内存构成（RSS、共享、独占、PSS，读取 /proc/self/smaps_rollup，仅 Linux），用来估算能启动多少个进程。
+  模型权重不在进程之间共享，每个工作进程各加载一份；要让多个并发批次共用一份权重，使用多线程模式（不加 --use_mp），
+  CTranslate2 在同一设备上的 inter 线程共享同一份模型。
+- --async：使用 asyncio 异步模式，适合 libretranslate 等 I/O 密集的 HTTP 后端，单个进程即可保持数百个请求在途；
+  进程内推理的后端会放到线程中执行。后端的并发上限由后端自身决定（HTTP 后端为 concurrency 或 pool 选项，
+  其他后端为 --threads）。结果按批次顺序收集，续跑逻辑与其他模式相同。
+- --max_in_flight：异步模式下同时在途的批次数上限，默认为 256。
+- --retries / --retry_delay：网络错误、超时、429/502/503/504 等临时错误的重试次数（默认 3）
+  和退避基准秒数（默认 0.5），退避时间带随机抖动；所有模式都生效。临时错误只重试整批，不拆分，
+  重试用完仍失败时才按内容错误二分定位。
+- --device：本机推理（argos、ct2 后端）使用的设备，默认为 auto：有可用的 CUDA 设备时用 GPU，否则用 CPU。
+  脚本会在工作线程/进程与每个模型的 inter/intra 原生线程之间分配 CPU 核心（工作数 × 每个模型的线程数不超过核心数），
+  多进程模式下进程数不超过核心数，并打印选定的线程布局。
+- --env_cache_file：环境缓存文件路径，默认为 ~/.cache/batch_translate/environment.json。
+  缓存记录已安装的语言包和设备检测结果，启动时不再导入 Argos Translate/PyTorch 逐一检查；
+  所有输入文件都已翻译完成时，脚本不检查环境、不加载模型，直接结束。
+- --refresh_env：忽略环境缓存，重新检查已安装的语言包和推理设备（同时打印 GPU 状态），并更新缓存。
+  环境缓存也记录了没有直接翻译包的语言对，之后安装了对应的语言包时，用该选项重新检查。
+- --pin_cpus：多进程 CPU 推理时，把每个工作进程绑定到互不重叠的一组核心（需要系统支持 sched_setaffinity）。
+- --max_memory：多进程模式下整个运行的内存预算（例如 6G、6000M，不带单位时为 MB）。启动时先加载一个工作进程，
+  按实测的模型占用（预留 25% 增长余量）计算预算内能容纳的进程数，--threads 超出时自动减少，避免在小内存机器上被 OOM 杀掉。
+- --worker_max_rss：单个工作进程的内存上限（格式同上）。工作进程每完成一批报告一次 RSS，超过上限的进程交回当前批次后退出，
+  由新进程接替（重新加载模型），其他进程中的批次不受影响。指定 --max_memory 而没有指定该选项时，上限为预算平均分给每个进程的份额。
+- --max_tasks_per_worker：每个工作进程处理多少个批次后由新进程接替，用来释放长时间运行中累积的内存碎片，默认不限。
+  工作进程意外退出（例如被 OOM killer 杀掉）时，它处理中的批次会交给其他进程重做，并启动新进程补上。
+- --persistent_pool：配合 --use_mp 使用，整个运行期间只创建一个进程池，多个输入文件共用，避免重复加载模型。
+- --compact_every：每完成一批就把结果追加写入 <输出文件>.log 并落盘（fsync），日志条目数达到该值
+  （且不少于已压缩的行数）时合并进按输入顺序排列的 CSV，默认为 10000。日志记录输入行号，合并时按行号排序后与
+  CSV 逐行归并，内存不随 CSV 大小增长。中断后再次运行会从 CSV 和日志续跑。
+- --normalize：翻译前的规范化去重规则，逗号分隔，默认为 space，可选：
+  space（合并多余空白）、case（忽略大小写）、paren（把 "API (application programming interface)"
+  拆成术语和括号中的全称分别翻译）；none 表示不做规范化。规范化后相同的内容只翻译一次，再映射回每一行。
+- --glossary：术语表文件，逗号分隔多个。.csv 文件为双语表（前两列为 原文,译文，可以直接使用审校过的翻译结果，
+  只有一列的行保持原样）；其他文件每行一个术语，"术语<Tab>译文" 指定固定译文，只写术语表示保持原样不翻译，# 开头的行为注释。
+  术语区分大小写，只匹配完整的词，用 Aho-Corasick 自动机一次扫描找出所有术语。整条就是术语的单元（例如 "CPU"、
+  规范化拆分后的 "DHCP"、只由术语和标点组成的 "CI/CD"）直接输出，不经过模型；含有术语的单元把术语换成 [0]、[1] 这样的
+  占位符后再翻译，译文中的占位符换回术语的译文，占位符在译文中丢失时该单元改为不保护术语重新翻译。
+  固定译文对所有目标语言生效，多个目标语言时请只使用保持原样的术语，或按语言分别运行。
+- --keep_acronyms：全大写的缩写（CPU、BIOS、CSV、ES6、APIs）视为保持原样的术语，可以单独使用，也可以与 --glossary 一起使用。
+- --backend：翻译后端，格式为 名称[:键=值,键=值]，默认为 argos。可选：
+  argos（本地 Argos Translate 模型）；
+  ct2:path=<模型目录>[,sp_model=..,device=auto|cpu|cuda]（直接调用 CTranslate2，不依赖 Argos）；
+  libretranslate:url=http://host:5000[,pool=8,chunk=32,api_key=..]（LibreTranslate 兼容的翻译服务，
+  长连接池复用，每批按 chunk 条拆分后在同一连接上流水线发送）；
+  fake[:token_ms=0.5,batch_ms=2,fail_on=子串]（不加载模型、按 token 数模拟耗时的假翻译器，用于基准测试和演练）。
+  翻译缓存和自动调优配置档案只按后端名称和模型位置（模型目录、服务地址）区分，api_key、pool 等选项不影响，
+  也不会写入缓存和配置档案。
+- --serve：以 --backend 指定的后端启动 LibreTranslate 兼容的本地翻译服务（例如 --serve 127.0.0.1:5000），
+  让多台机器共用一台翻译服务器，也可以配合 fake 后端离线测试 HTTP 后端。
+- --auto：自动选择线程/进程数、每批单词数和线程/进程模式。首次运行时用输入中的一小部分样本试跑候选配置，
+  测出本机最快的组合后记录到配置档案（默认 ~/.cache/batch_translate/profile.json），之后的运行直接复用。
+- --auto_sample：自动调优时试跑的样本单词数，默认为 200。
+- --recalibrate：配合 --auto 使用，忽略已记录的配置档案，重新试跑。
+- --profile_file：自动调优配置档案的路径。
+- --cache_file：持久化翻译缓存（SQLite）路径，默认为 ~/.cache/batch_translate/translations.sqlite3，跨运行、跨输入文件共享。
+- --cache_max_entries：缓存最多保留的条目数，超出后按最近使用时间淘汰，默认为 1000000。
+- --no_cache：不使用持久化翻译缓存。
+- --fuzzy_policy：翻译记忆的模糊匹配策略，需要持久化缓存，默认为 off。开启后在分批之前先查缓存：精确命中的条目直接输出；
+  其余条目在缓存中找最相似的已译原文（忽略大小写和标点两侧的空白，例如 "CI / CD" 与 "CI/CD"，再按字符 3-gram 的
+  Jaccard 相似度计算，用 MinHash 分桶索引，每次查询通常在 1 毫秒以内，与缓存条目数无关）。
+  hint：所有条目仍交给模型，相似条目写入报告供审校参考；reuse：相似度达到 --fuzzy_threshold（默认 0.9）的条目
+  直接复用相似条目的译文、不经过模型，并在报告中标为"复用"。第一次开启时会为已有的缓存条目补建索引。
+- --fuzzy_hint_threshold：写入报告的最低相似度，默认为 0.6。
+- --fuzzy_report：模糊匹配报告（CSV，追加写入），列为 源语言、目标语言、原文、相似原文、相似度、参考译文、处理（复用/提示），
+  默认为 fuzzy_matches.csv。
 
 注意：在运行之前，请确保已在系统中安装了 Argos Translate 的相关翻译包。
 """
-import pandas as pd
-import argostranslate.package
-import argostranslate.translate
 import os
 import sys
 import time
 import threading
 import queue
+import socket
+import urllib.parse
 import argparse
+import asyncio
+import collections
+import contextvars
+import csv
+import gzip
+import hashlib
+import heapq
+import itertools
+import json
+import platform
+import random
+import re
+import sqlite3
+import unicodedata
+import zlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
-from tqdm import tqdm
 import multiprocessing as mp
+import multiprocessing.connection
 
-# 设置环境变量以启用 GPU 加速（如果可用）
-os.environ["ARGOS_DEVICE_TYPE"] = "cuda"  # 强制使用CUDA，确保确实尝试GPU
+# 默认的持久化缓存位置
+DEFAULT_CACHE_FILE = os.path.join(str(Path.home()), '.cache', 'batch_translate', 'translations.sqlite3')
+
+# 默认的自动调优配置档案位置
+DEFAULT_PROFILE_FILE = os.path.join(str(Path.home()), '.cache', 'batch_translate', 'profile.json')
+
+# 默认的环境缓存位置：记录已安装的语言包和设备检测结果，避免每次启动都导入 Argos/PyTorch 重新检查
+DEFAULT_ENV_CACHE_FILE = os.path.join(str(Path.home()), '.cache', 'batch_translate', 'environment.json')
+
+# 读取环境缓存，文件不存在或已损坏时返回空记录
+def load_env_cache(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as file:
+            env = json.load(file)
+        if isinstance(env, dict):
+            env.setdefault('packages', {})
+            return env
+    except (OSError, ValueError):
+        pass
+    return {'packages': {}}
+
+# 保存环境缓存（先写临时文件再替换，避免并发运行读到半个文件）
+def save_env_cache(path, env):
+    try:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        temp_file = path + '.tmp'
+        with open(temp_file, 'w', encoding='utf-8') as file:
+            json.dump(env, file, ensure_ascii=False, indent=2)
+        os.replace(temp_file, path)
+    except OSError as e:
+        print(f"保存环境缓存时出错: {str(e)}")
+
+# 推理设备：优先使用环境缓存中的检测结果，没有记录或要求重新检查时才检测并写回缓存
+def cached_device(env, refresh=False):
+    if refresh or env.get('device') not in ('cpu', 'cuda'):
+        env['device'] = detect_device()
+        env['device_checked_at'] = time.strftime('%Y-%m-%dT%H:%M:%S')
+        env['dirty'] = True
+    return env['device']
+
+# 检测推理设备：优先用 CTranslate2 自带的检测，其次 PyTorch，都不可用时使用 CPU
+def detect_device():
+    try:
+        import ctranslate2
+        return 'cuda' if ctranslate2.get_cuda_device_count() > 0 else 'cpu'
+    except Exception:
+        pass
+    try:
+        import torch
+        return 'cuda' if torch.cuda.is_available() else 'cpu'
+    except Exception:
+        pass
+    return 'cpu'
+
+# 当前进程可用的 CPU 核心（考虑 taskset/容器的限制）
+def available_cpus():
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+# 当前进程的常驻内存（MB）：Linux 上读 /proc/self/statm，其他系统退回到峰值 RSS
+def current_rss_mb():
+    try:
+        with open('/proc/self/statm', 'r') as file:
+            return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+    except (OSError, ValueError, IndexError, AttributeError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    # Linux 上 ru_maxrss 以 KB 为单位，macOS 上以字节为单位
+    scale = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+
+# 当前进程的内存构成（MB）：rss 常驻内存、shared 与其他进程共享的页（共享库、fork 后未改写的页）、
+# private 本进程独占的页、pss 按共享进程数分摊后的占用。读取 /proc/self/smaps_rollup，不可用时返回 None
+def memory_breakdown():
+    fields = {}
+    try:
+        with open('/proc/self/smaps_rollup', 'r') as file:
+            for line in file:
+                name, _, value = line.partition(':')
+                parts = value.split()
+                if len(parts) == 2 and parts[1] == 'kB':
+                    fields[name] = int(parts[0]) / 1024
+    except OSError:
+        return None
+    if 'Rss' not in fields:
+        return None
+    return {
+        'rss': fields['Rss'],
+        'pss': fields.get('Pss', fields['Rss']),
+        'shared': fields.get('Shared_Clean', 0.0) + fields.get('Shared_Dirty', 0.0),
+        'private': fields.get('Private_Clean', 0.0) + fields.get('Private_Dirty', 0.0),
+    }
+
+# 解析内存大小，支持 6G、6000M 或不带单位的 MB 数
+def parse_memory_size(value):
+    text = str(value).strip().upper().rstrip('B')
+    scale = 1
+    if text.endswith('G'):
+        text, scale = text[:-1], 1024
+    elif text.endswith('M'):
+        text = text[:-1]
+    try:
+        size = float(text) * scale
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"无法识别的内存大小: {value}（示例: 6G、6000M）")
+    if size <= 0:
+        raise argparse.ArgumentTypeError(f"内存大小必须大于 0: {value}")
+    return size
+
+# 规划线程预算：在工作线程/进程与每个模型的 inter/intra 原生线程之间分配 CPU 核心，
+# 保证 工作数 × 每个模型的线程数 不超过核心数，避免原生线程池互相争抢
+# - 多进程：每个进程一份模型，inter=1，intra=核心数/进程数，进程数不超过核心数，可选把每个进程绑定到互不重叠的核心
+# - 多线程/异步：所有线程共享一份模型，inter=并发批次数，intra=核心数/inter
+# - GPU：CPU 线程只负责调度，每个模型 inter=1、intra=1
+def plan_thread_budget(device, workers, use_processes, pin=False):
+    cpus = available_cpus()
+    cores = len(cpus)
+    budget = {'device': device, 'cores': cores, 'workers': workers, 'processes': use_processes,
+              'inter_threads': 1, 'intra_threads': 1, 'cpu_sets': None}
+    if device == 'cuda':
+        return budget
+    if use_processes:
+        workers = max(1, min(workers, cores))
+        intra = max(1, cores // workers)
+        budget.update(workers=workers, intra_threads=intra)
+        if pin and hasattr(os, 'sched_setaffinity'):
+            budget['cpu_sets'] = [cpus[i*intra:(i+1)*intra] for i in range(workers)]
+    else:
+        inter = max(1, min(workers, cores))
+        budget.update(inter_threads=inter, intra_threads=max(1, cores // inter))
+    return budget
+
+# 应用线程预算：通过环境变量传给本进程之后创建的模型和之后启动的工作进程
+def apply_thread_budget(budget):
+    os.environ['ARGOS_DEVICE_TYPE'] = budget['device']
+    os.environ['ARGOS_INTER_THREADS'] = str(budget['inter_threads'])
+    os.environ['ARGOS_INTRA_THREADS'] = str(budget['intra_threads'])
+    os.environ['OMP_NUM_THREADS'] = str(budget['intra_threads'])
+
+# 打印选定的线程布局
+def describe_thread_budget(budget):
+    if budget['processes']:
+        layout = f"{budget['workers']} 个工作进程 × 每个模型 inter {budget['inter_threads']} / intra {budget['intra_threads']} 线程"
+    else:
+        layout = f"{budget['workers']} 个工作线程共享 1 个模型（inter {budget['inter_threads']} / intra {budget['intra_threads']} 线程）"
+    pin = ''
+    if budget['cpu_sets']:
+        pin = "，每个进程绑定 CPU: " + '; '.join(','.join(map(str, cpu_set)) for cpu_set in budget['cpu_sets'])
+    print(f"线程预算：设备 {budget['device']}，可用核心 {budget['cores']}，{layout}{pin}")
 
 # 检查GPU状态
 def check_gpu_status():
@@ -70,27 +349,356 @@ def check_gpu_status():
             print("无法获取GPU信息，可能未安装NVIDIA显卡或驱动")
     print("========================\n")
 
-# 解析命令行参数
-def parse_arguments():
+# 解析命令行参数（argv 为 None 时使用 sys.argv）
+def parse_arguments(argv=None):
     parser = argparse.ArgumentParser(description='批量翻译英文单词到中文')
-    parser.add_argument('input_file', type=str, help='输入文件路径')
+    parser.add_argument('input_file', type=str, nargs='*', help='输入文件路径，可指定多个')
     parser.add_argument('--from_lang', type=str, default='en', help='源语言代码 (默认: en)')
-    parser.add_argument('--to_lang', type=str, default='zh', help='目标语言代码 (默认: zh)')
+    parser.add_argument('--to_lang', type=str, default='zh', help='目标语言代码，多个语言用逗号分隔 (默认: zh)')
+    parser.add_argument('--column', type=str, default=None, help='CSV/TSV 输入的列名或序号，JSONL 输入的字段名 (默认: 第一列 / text)')
+    parser.add_argument('--stream', action='store_true', help='流式处理：分块读取和写出，内存占用与输入大小无关')
+    parser.add_argument('--chunk_size', type=int, default=50000, help='流式处理时每块的单词数 (默认: 50000)')
+    parser.add_argument('--reorder_window', type=int, default=2000, help='流式处理时每多少个单词单独分桶组批，0 表示整块分桶 (默认: 2000)')
+    parser.add_argument('--output_format', type=str, default='csv', choices=list(OUTPUT_FORMATS), help='输出格式: csv, jsonl, parquet, flashcard (默认: csv)')
+    parser.add_argument('--shard', type=str, default=None, help='只翻译第 i 个分片（共 N 个，i 从 0 开始），格式 i/N')
+    parser.add_argument('--metrics_trace', type=str, default=None, help='把每批的分阶段耗时追加写入该 JSONL 文件')
+    parser.add_argument('--metrics_prom', type=str, default=None, help='运行期间定期刷新的 Prometheus 文本格式指标文件')
+    parser.add_argument('--metrics_interval', type=float, default=10.0, help='刷新 Prometheus 指标文件的间隔秒数 (默认: 10)')
+    parser.add_argument('--pivot_lang', type=str, default='en', help='没有直接翻译包时使用的中间语言 (默认: en)')
+    parser.add_argument('--output_layout', type=str, default='files', choices=['files', 'wide'], help='多个目标语言时的输出格式: files 每种语言一个文件, wide 额外合并成宽表 (默认: files)')
     parser.add_argument('--threads', type=int, default=4, help='翻译进程/线程数 (默认: 4)')
-    parser.add_argument('--batch_size', type=int, default=20, help='每批处理的单词数 (默认: 20)')
+    parser.add_argument('--batch_size', type=int, default=20, help='每批处理的单词数上限 (默认: 20)')
+    parser.add_argument('--token_budget', type=int, default=160, help='每批的 token 预算，含填充 (默认: 160)')
     parser.add_argument('--use_mp', action='store_true', help='使用多进程而非多线程')
-    return parser.parse_args()
+    parser.add_argument('--async', dest='use_async', action='store_true', help='使用 asyncio 异步模式 (适合 HTTP 后端)')
+    parser.add_argument('--max_in_flight', type=int, default=256, help='异步模式下同时在途的批次数上限 (默认: 256)')
+    parser.add_argument('--retries', type=int, default=3, help='临时错误的重试次数 (默认: 3)')
+    parser.add_argument('--retry_delay', type=float, default=0.5, help='重试退避的基准秒数 (默认: 0.5)')
+    parser.add_argument('--env_cache_file', type=str, default=DEFAULT_ENV_CACHE_FILE, help=f'环境缓存文件路径 (默认: {DEFAULT_ENV_CACHE_FILE})')
+    parser.add_argument('--refresh_env', action='store_true', help='忽略环境缓存，重新检查已安装的语言包和推理设备')
+    parser.add_argument('--device', type=str, default='auto', choices=['auto', 'cpu', 'cuda'], help='推理设备 (默认: auto，自动检测)')
+    parser.add_argument('--pin_cpus', action='store_true', help='多进程模式下把每个工作进程绑定到互不重叠的 CPU 核心')
+    parser.add_argument('--max_memory', type=parse_memory_size, default=None, help='多进程模式下的总内存预算，如 6G，按实测的模型占用限制进程数')
+    parser.add_argument('--worker_max_rss', type=parse_memory_size, default=None, help='单个工作进程的内存上限，如 1500M，超过后由新进程接替')
+    parser.add_argument('--max_tasks_per_worker', type=int, default=None, help='每个工作进程处理多少个批次后由新进程接替 (默认: 不限)')
+    parser.add_argument('--persistent_pool', action='store_true', help='多个输入文件共用一个常驻进程池 (配合 --use_mp)')
+    parser.add_argument('--compact_every', type=int, default=10000, help='结果日志累积多少条后压缩进 CSV (默认: 10000)')
+    parser.add_argument('--glossary', type=str, default=None, help='术语表文件，逗号分隔多个: 每行 "术语[<Tab>译文]"，或 .csv 双语表')
+    parser.add_argument('--keep_acronyms', action='store_true', help='全大写的缩写 (CPU, BIOS, CSV) 保持原样，不交给模型')
+    parser.add_argument('--normalize', type=str, default='space', help='规范化去重规则，逗号分隔: space,case,paren 或 none (默认: space)')
+    parser.add_argument('--backend', type=str, default='argos', help='翻译后端: argos、ct2:path=..[,sp_model=..,device=..]、libretranslate:url=..[,pool=..,chunk=..,api_key=..] '
+                             '或 fake[:token_ms=..,batch_ms=..,fail_on=..] (默认: argos)')
+    parser.add_argument('--auto', action='store_true', help='自动选择线程/进程数、每批单词数和执行模式')
+    parser.add_argument('--auto_sample', type=int, default=200, help='自动调优试跑的样本单词数 (默认: 200)')
+    parser.add_argument('--recalibrate', action='store_true', help='忽略已记录的配置档案，重新试跑')
+    parser.add_argument('--profile_file', type=str, default=DEFAULT_PROFILE_FILE, help=f'自动调优配置档案路径 (默认: {DEFAULT_PROFILE_FILE})')
+    parser.add_argument('--cache_file', type=str, default=DEFAULT_CACHE_FILE, help=f'持久化翻译缓存路径 (默认: {DEFAULT_CACHE_FILE})')
+    parser.add_argument('--cache_max_entries', type=int, default=1000000, help='缓存最多保留的条目数 (默认: 1000000)')
+    parser.add_argument('--no_cache', action='store_true', help='不使用持久化翻译缓存')
+    parser.add_argument('--fuzzy_policy', type=str, default='off', choices=['off', 'hint', 'reuse'], help='翻译记忆的模糊匹配策略: off, hint 只给出参考, reuse 复用足够相似的译文 (默认: off)')
+    parser.add_argument('--fuzzy_threshold', type=float, default=0.9, help='reuse 策略下直接复用译文的最低相似度 (默认: 0.9)')
+    parser.add_argument('--fuzzy_hint_threshold', type=float, default=0.6, help='写入参考报告的最低相似度 (默认: 0.6)')
+    parser.add_argument('--fuzzy_report', type=str, default='fuzzy_matches.csv', help='模糊匹配报告文件 (默认: fuzzy_matches.csv)')
+    parser.add_argument('--serve', type=str, default=None, metavar='HOST:PORT', help='以 --backend 启动 LibreTranslate 兼容的本地翻译服务')
+    args = parser.parse_args(argv)
+    if not args.input_file and not args.serve:
+        parser.error('需要指定输入文件')
+    if args.use_async and args.use_mp:
+        parser.error('--async 和 --use_mp 不能同时使用')
+    if args.stream and args.output_layout == 'wide':
+        parser.error('--stream 不支持 --output_layout wide')
+    if args.chunk_size < 1:
+        parser.error('--chunk_size 必须大于 0')
+    args.shard_index = args.shard_count = None
+    if args.shard:
+        try:
+            args.shard_index, args.shard_count = parse_shard(args.shard)
+        except ValueError as e:
+            parser.error(str(e))
+    return args
+
+# 规范化缓存键：统一 Unicode 形式并压缩多余空白
+def normalize_cache_key(text):
+    return ' '.join(unicodedata.normalize('NFKC', text).split())
+
+# 翻译记忆的模糊匹配：原文折叠大小写和标点两侧的空白（"CI / CD" 与 "ci/cd" 相同）后取字符 3-gram，
+# 用 MinHash 签名分成 FUZZY_BANDS 段，每段的哈希作为桶键存进缓存数据库（LSH）。
+# 查询时只取同桶的候选，再用 3-gram 的 Jaccard 相似度核对，查询代价与缓存条目数无关
+FUZZY_BANDS = 6
+FUZZY_ROWS = 3
+# 每个 MinHash 分量用 3-gram 的 crc32 异或一个固定的随机掩码作为置换，比乘法取模快得多
+MINHASH_MASKS = [random.Random(20240917 + i).getrandbits(32) for i in range(FUZZY_BANDS * FUZZY_ROWS)]
+_fuzzy_punct_space = re.compile(r'\s*([^\w\s])\s*')
+
+# 模糊匹配用的折叠形式
+def fuzzy_fold(text):
+    return _fuzzy_punct_space.sub(r'\1', normalize_cache_key(text).casefold())
+
+# 折叠后文本的字符 3-gram 集合（首尾补空格，让词首词尾也有权重）
+def fuzzy_shingles(text, size=3):
+    padded = f" {fuzzy_fold(text)} "
+    if len(padded) <= size:
+        return {padded}
+    return {padded[i:i+size] for i in range(len(padded) - size + 1)}
+
+# 两个 3-gram 集合的 Jaccard 相似度
+def jaccard(a, b):
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+# MinHash 签名分段后的桶键；tag 区分语言对和模型版本。crc32 不受 PYTHONHASHSEED 影响，各进程算出的桶键一致
+def fuzzy_band_keys(shingles, tag):
+    hashes = [zlib.crc32(shingle.encode('utf-8')) for shingle in shingles]
+    signature = [min([h ^ mask for h in hashes]) for mask in MINHASH_MASKS]
+    keys = []
+    for band in range(FUZZY_BANDS):
+        values = signature[band * FUZZY_ROWS:(band + 1) * FUZZY_ROWS]
+        digest = hashlib.blake2b(f"{tag}|{band}|{values}".encode('utf-8'), digest_size=8).digest()
+        keys.append(int.from_bytes(digest, 'big', signed=True))
+    return keys
+
+# 持久化翻译缓存
+# 键为 (源语言, 目标语言, 模型包版本, 规范化原文)，使用 SQLite 的 WAL 模式，
+# 允许多个线程/进程同时读取；每个线程使用自己的连接，进程池中可直接传递（序列化时不带连接）
+class TranslationCache:
+    # 每次批量查询 IN (...) 的最大参数个数，避免超过 SQLite 的变量上限
+    CHUNK_SIZE = 500
+    # 每写入多少条检查一次是否需要淘汰
+    EVICT_CHECK_INTERVAL = 1000
+    # 模糊查询时每个桶最多读取的条目数，以及最多核对相似度的候选数
+    FUZZY_BUCKET_SCAN = 16
+    FUZZY_CANDIDATES = 8
+
+    def __init__(self, path, from_lang, to_lang, model_version, max_entries=1000000):
+        self.path = str(path)
+        self.from_lang = from_lang
+        self.to_lang = to_lang
+        self.model_version = model_version or ''
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._writes_since_check = 0
+        self.fuzzy = False
+        self.fuzzy_tag = f"{from_lang}|{to_lang}|{self.model_version}"
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        self._init_schema()
+
+    # 进程池传参时只序列化配置；工作进程中同一个缓存只创建一次（见 worker_cache），
+    # 连接和淘汰检查的写入计数在该进程的所有批次之间保留
+    def __reduce__(self):
+        return (worker_cache, (self.path, self.from_lang, self.to_lang, self.model_version, self.max_entries, self.fuzzy))
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def _init_schema(self):
+        conn = self._connect()
+        with conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS translations (
+                    from_lang TEXT NOT NULL,
+                    to_lang TEXT NOT NULL,
+                    model_version TEXT NOT NULL,
+                    source TEXT NOT NULL,
+                    translation TEXT NOT NULL,
+                    last_used REAL NOT NULL,
+                    PRIMARY KEY (from_lang, to_lang, model_version, source)
+                )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_translations_last_used ON translations (last_used)')
+
+    # 批量查询，返回 {原文: 译文}，只包含命中的条目
+    def get_many(self, texts):
+        keys = {}
+        for text in texts:
+            keys.setdefault(normalize_cache_key(text), []).append(text)
+        found = {}
+        if not keys:
+            return found
+        conn = self._connect()
+        key_list = list(keys)
+        hit_keys = []
+        for i in range(0, len(key_list), self.CHUNK_SIZE):
+            chunk = key_list[i:i+self.CHUNK_SIZE]
+            placeholders = ','.join('?' * len(chunk))
+            rows = conn.execute(
+                f'SELECT source, translation FROM translations '
+                f'WHERE from_lang=? AND to_lang=? AND model_version=? AND source IN ({placeholders})',
+                [self.from_lang, self.to_lang, self.model_version] + chunk
+            ).fetchall()
+            for source, translation in rows:
+                hit_keys.append(source)
+                for text in keys[source]:
+                    found[text] = translation
+        # 刷新命中条目的使用时间，供淘汰时参考；数据库被其他进程锁住时跳过即可
+        if hit_keys:
+            now = time.time()
+            try:
+                with conn:
+                    conn.executemany(
+                        'UPDATE translations SET last_used=? '
+                        'WHERE from_lang=? AND to_lang=? AND model_version=? AND source=?',
+                        [(now, self.from_lang, self.to_lang, self.model_version, key) for key in hit_keys]
+                    )
+            except sqlite3.OperationalError:
+                pass
+        return found
+
+    # 批量写入 {原文: 译文}
+    def put_many(self, translations):
+        if not translations:
+            return
+        now = time.time()
+        rows = [
+            (self.from_lang, self.to_lang, self.model_version, normalize_cache_key(source), translation, now)
+            for source, translation in translations.items()
+        ]
+        conn = self._connect()
+        with conn:
+            conn.executemany('INSERT OR REPLACE INTO translations VALUES (?, ?, ?, ?, ?, ?)', rows)
+            if self.fuzzy:
+                self._index_fuzzy(conn, self._entry_ids(conn, list({row[3] for row in rows})))
+        self._writes_since_check += len(rows)
+        if self._writes_since_check >= self.EVICT_CHECK_INTERVAL:
+            self._writes_since_check = 0
+            self.evict()
+
+    # 超出容量时按最近使用时间淘汰最旧的条目
+    def evict(self):
+        conn = self._connect()
+        count = conn.execute('SELECT COUNT(*) FROM translations').fetchone()[0]
+        excess = count - self.max_entries
+        if excess > 0:
+            with conn:
+                conn.execute(
+                    'DELETE FROM translations WHERE rowid IN '
+                    '(SELECT rowid FROM translations ORDER BY last_used LIMIT ?)',
+                    (excess,)
+                )
+                if self.fuzzy:
+                    # 被淘汰或被覆盖的条目留下的索引
+                    conn.execute('DELETE FROM fuzzy_bands WHERE entry NOT IN (SELECT rowid FROM translations)')
+
+    # 开启模糊匹配：建立索引表，为还没有索引的已有条目补建索引（只在第一次开启时较慢），
+    # 之后 put_many 写入的条目同时写入索引
+    def enable_fuzzy(self):
+        conn = self._connect()
+        with conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS fuzzy_bands (band_key INTEGER NOT NULL, entry INTEGER NOT NULL)')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_fuzzy_bands_key ON fuzzy_bands (band_key)')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_fuzzy_bands_entry ON fuzzy_bands (entry)')
+        rows = conn.execute(
+            'SELECT rowid, source FROM translations WHERE from_lang=? AND to_lang=? AND model_version=? '
+            'AND rowid NOT IN (SELECT entry FROM fuzzy_bands)',
+            (self.from_lang, self.to_lang, self.model_version)
+        ).fetchall()
+        if rows:
+            print(f"为 {len(rows)} 条缓存（{self.from_lang} → {self.to_lang}）建立模糊匹配索引...")
+            with conn:
+                self._index_fuzzy(conn, rows)
+        self.fuzzy = True
+
+    # 查出一组原文对应的 (rowid, 原文)
+    def _entry_ids(self, conn, sources):
+        entries = []
+        for i in range(0, len(sources), self.CHUNK_SIZE):
+            chunk = sources[i:i+self.CHUNK_SIZE]
+            placeholders = ','.join('?' * len(chunk))
+            entries.extend(conn.execute(
+                f'SELECT rowid, source FROM translations '
+                f'WHERE from_lang=? AND to_lang=? AND model_version=? AND source IN ({placeholders})',
+                [self.from_lang, self.to_lang, self.model_version] + chunk
+            ).fetchall())
+        return entries
+
+    # 写入条目的桶键（调用方负责事务）
+    def _index_fuzzy(self, conn, entries):
+        conn.executemany(
+            'INSERT INTO fuzzy_bands VALUES (?, ?)',
+            ((key, rowid) for rowid, source in entries for key in fuzzy_band_keys(fuzzy_shingles(source), self.fuzzy_tag))
+        )
+
+    # 查找与 text 最相似、相似度不低于 min_score 的缓存条目，返回 (相似度, 原文, 译文) 或 None
+    # 每个桶只取前 FUZZY_BUCKET_SCAN 个条目，按与 text 同桶的段数排序后核对前 FUZZY_CANDIDATES 个，
+    # 查询代价与缓存大小无关（常见短词的桶可能有上万个条目）
+    def fuzzy_lookup(self, text, min_score):
+        shingles = fuzzy_shingles(text)
+        params = []
+        for key in fuzzy_band_keys(shingles, self.fuzzy_tag):
+            params += [key, self.FUZZY_BUCKET_SCAN]
+        conn = self._connect()
+        shared = collections.Counter(row[0] for row in conn.execute(
+            ' UNION ALL '.join(['SELECT * FROM (SELECT entry FROM fuzzy_bands WHERE band_key=? LIMIT ?)'] * FUZZY_BANDS),
+            params
+        ))
+        entries = [entry for entry, _ in shared.most_common(self.FUZZY_CANDIDATES)]
+        if not entries:
+            return None
+        # 语言对的条件加 + 号，让 SQLite 按 rowid 查找而不是走主键索引扫描整个语言对
+        rows = conn.execute(
+            f'SELECT source, translation FROM translations WHERE rowid IN ({",".join("?" * len(entries))}) '
+            f'AND +from_lang=? AND +to_lang=? AND +model_version=?',
+            entries + [self.from_lang, self.to_lang, self.model_version]
+        ).fetchall()
+        best = None
+        for source, translation in rows:
+            score = jaccard(shingles, fuzzy_shingles(source))
+            if score >= min_score and (best is None or score > best[0]):
+                best = (score, source, translation)
+        return best
+
+# 工作进程内按配置缓存反序列化出的 TranslationCache：每个任务都带着缓存参数，
+# 不缓存的话每批都会新建对象、重新打开连接，写入计数也从 0 开始，永远到不了淘汰检查的间隔
+_worker_caches = {}
+
+def worker_cache(path, from_lang, to_lang, model_version, max_entries, fuzzy):
+    key = (path, from_lang, to_lang, model_version, max_entries)
+    cache = _worker_caches.get(key)
+    if cache is None:
+        cache = TranslationCache(path, from_lang, to_lang, model_version, max_entries)
+        _worker_caches[key] = cache
+    # 索引表已由主进程建好，这里只需要在写入时同时写索引
+    cache.fuzzy = fuzzy
+    return cache
 
 # 下载并安装 Argos Translate 包（如果尚未安装）
-def install_translation_package(from_code, to_code):
+# env 为环境缓存：记录过且模型目录仍然存在的语言包直接返回版本号，不导入 argostranslate
+# required 为 False 时，找不到语言包返回 None 而不是退出，由调用方尝试经中间语言中转
+def install_translation_package(from_code, to_code, env=None, required=True):
+    pair = f"{from_code}-{to_code}"
+    record = env['packages'].get(pair) if env is not None else None
+    if record and (not record.get('path') or os.path.isdir(record['path'])):
+        print(f"已安装 {from_code} 到 {to_code} 的翻译包（环境缓存）")
+        return record.get('version', '')
+    if not required and env is not None and pair in env.get('missing', []):
+        # 上次已确认没有直接的语言包，不再联网查询索引
+        print(f"没有从 {from_code} 到 {to_code} 的翻译包（环境缓存）")
+        return None
+    
+    import argostranslate.package
     print(f"正在检查 {from_code} 到 {to_code} 的翻译包...")
     
-    # 检查是否已安装该语言包
+    # 检查是否已安装该语言包，顺便把所有已安装的语言包记入环境缓存
     installed_packages = argostranslate.package.get_installed_packages()
+    if env is not None:
+        env['packages'] = {
+            f"{package.from_code}-{package.to_code}": {
+                'version': getattr(package, 'package_version', ''),
+                'path': str(package.package_path) if getattr(package, 'package_path', None) else '',
+            }
+            for package in installed_packages
+        }
+        env['dirty'] = True
     for package in installed_packages:
         if package.from_code == from_code and package.to_code == to_code:
             print(f"已安装 {from_code} 到 {to_code} 的翻译包")
-            return
+            return getattr(package, 'package_version', '')
     
     # 如果未安装，则下载并安装
     print(f"未找到 {from_code} 到 {to_code} 的翻译包，正在下载...")
@@ -104,252 +712,3249 @@ def install_translation_package(from_code, to_code):
         print(f"正在安装 {from_code} 到 {to_code} 的翻译包...")
         argostranslate.package.install_from_path(package_to_install.download())
         print(f"安装完成！")
+        if env is not None:
+            # 安装后的模型目录要重新查询，下次启动时再记录
+            env['packages'].pop(pair, None)
+            env['dirty'] = True
+        return getattr(package_to_install, 'package_version', '')
     except StopIteration:
+        if not required:
+            print(f"没有从 {from_code} 到 {to_code} 的翻译包")
+            if env is not None:
+                env.setdefault('missing', []).append(pair)
+                env['dirty'] = True
+            return None
         print(f"错误：找不到从 {from_code} 到 {to_code} 的翻译包")
         sys.exit(1)
 
-# 批量翻译工作线程函数
-def translate_worker(work_queue, result_dict, from_lang, to_lang, batch_size=10):
-    while True:
-        try:
-            # 尝试获取一批单词
-            batch = []
-            for _ in range(batch_size):
+# 规划每个目标语言的翻译路线：有直接的语言包就直接翻译，否则经 pivot_lang 中转（两段都必须可用）
+# 返回 ({目标语言: 中间语言或 None}, {(源语言, 目标语言): 模型版本})，版本用于为每一段单独建缓存
+def plan_translation_routes(from_lang, to_langs, pivot_lang, env=None):
+    pivots = {}
+    versions = {}
+    for to_lang in to_langs:
+        version = install_translation_package(from_lang, to_lang, env, required=False)
+        if version is not None:
+            pivots[to_lang] = None
+            versions[(from_lang, to_lang)] = version
+            continue
+        first = second = None
+        if pivot_lang not in (from_lang, to_lang):
+            first = install_translation_package(from_lang, pivot_lang, env, required=False)
+            if first is not None:
+                second = install_translation_package(pivot_lang, to_lang, env, required=False)
+        if second is None:
+            print(f"错误：找不到从 {from_lang} 到 {to_lang} 的翻译包，也无法经 {pivot_lang} 中转")
+            sys.exit(1)
+        print(f"{from_lang} → {to_lang} 将经 {pivot_lang} 中转翻译")
+        pivots[to_lang] = pivot_lang
+        versions[(from_lang, pivot_lang)] = first
+        versions[(pivot_lang, to_lang)] = second
+    return pivots, versions
+
+# 每批的性能明细：翻译一批时把各阶段耗时（秒）和事件计数记到当前上下文的 trace 中，随结果一起返回主进程。
+# 使用 contextvars 而不是线程局部变量，asyncio 的每个任务和 asyncio.to_thread 都能拿到自己的 trace
+METRIC_STAGES = ('queue_wait', 'cache_read', 'tokenize', 'inference', 'detokenize', 'cache_write', 'write')
+MODEL_STAGES = ('tokenize', 'inference', 'detokenize')
+_batch_trace = contextvars.ContextVar('batch_trace', default=None)
+
+# 开始记录一批，返回新的 trace
+def begin_trace():
+    trace = {'stages': {}, 'counters': {}}
+    _batch_trace.set(trace)
+    return trace
+
+# 结束记录，之后的阶段耗时不再计入
+def end_trace():
+    _batch_trace.set(None)
+
+# 累加当前批次某个阶段的耗时，没有在记录时什么也不做
+def add_stage(name, seconds):
+    trace = _batch_trace.get()
+    if trace is not None:
+        trace['stages'][name] = trace['stages'].get(name, 0.0) + seconds
+
+# 累加当前批次的事件计数（二分重试、结果数量不匹配、失败条目等）
+def add_count(name, value=1):
+    trace = _batch_trace.get()
+    if trace is not None:
+        trace['counters'][name] = trace['counters'].get(name, 0) + value
+
+# 当前批次在若干阶段上已记录的总耗时
+def trace_stage_total(names):
+    trace = _batch_trace.get()
+    if trace is None:
+        return 0.0
+    return sum(trace['stages'].get(name, 0.0) for name in names)
+
+# 翻译后端接口：每个后端都提供 translate_segments(segments)，把一组文本作为一个批次翻译，
+# 返回与输入一一对应的译文列表，不依赖模型原样保留任何分隔符
+class TranslationBackend:
+    # 异步模式下该后端同时处理的批次数上限，None 表示使用 --threads
+    max_concurrency = None
+
+    # 预热：提前加载模型（或建立连接）并完成一次翻译，让惰性初始化在真正干活前完成
+    def warm_up(self):
+        self.translate_segments(['hello'])
+
+    def translate_segments(self, segments):
+        raise NotImplementedError
+
+    # 异步翻译接口：进程内推理的后端放到线程中执行，不阻塞事件循环；网络后端可以重写为原生异步实现
+    async def translate_segments_async(self, segments):
+        return await asyncio.to_thread(self.translate_segments, segments)
+
+    # 释放连接等资源
+    def close(self):
+        pass
+
+# 与 Argos Translate 默认解码参数保持一致
+CT2_BEAM_SIZE = 4
+CT2_LENGTH_PENALTY = 0.2
+
+# 用 CTranslate2 模型一次批量前向推理翻译整批文本；encode/decode 负责文本与子词之间的转换
+def ctranslate2_translate(model, encode, decode, segments, target_prefix=''):
+    if not segments:
+        return []
+    start = time.perf_counter()
+    tokenized = [encode(segment) for segment in segments]
+    add_stage('tokenize', time.perf_counter() - start)
+    prefix = [[target_prefix]] * len(tokenized) if target_prefix else None
+    start = time.perf_counter()
+    results = model.translate_batch(
+        tokenized,
+        target_prefix=prefix,
+        replace_unknowns=True,
+        max_batch_size=len(tokenized),
+        beam_size=CT2_BEAM_SIZE,
+        num_hypotheses=1,
+        length_penalty=CT2_LENGTH_PENALTY,
+    )
+    add_stage('inference', time.perf_counter() - start)
+    start = time.perf_counter()
+    outputs = []
+    for result in results:
+        tokens = result.hypotheses[0]
+        if target_prefix and tokens and tokens[0] == target_prefix:
+            tokens = tokens[1:]
+        value = decode(tokens)
+        if value.startswith(' '):
+            value = value[1:]
+        outputs.append(value)
+    add_stage('detokenize', time.perf_counter() - start)
+    if len(outputs) != len(segments):
+        add_count('mismatches')
+        raise ValueError(f"批量翻译结果数量不匹配: 输入 {len(segments)} 条，输出 {len(outputs)} 条")
+    return outputs
+
+# Argos Translate 后端：找到已安装的 Argos 包，直接调用其底层 CTranslate2 模型整批推理；
+# 经中间语言组合出的翻译（没有单独的包）等无法直接访问模型的情况退回到逐条调用 Argos 的翻译对象
+class ArgosBackend(TranslationBackend):
+    def __init__(self, from_lang, to_lang):
+        import argostranslate.translate
+        self.from_lang = from_lang
+        self.to_lang = to_lang
+        self.translation = argostranslate.translate.get_translation_from_codes(from_lang, to_lang)
+        if self.translation is None:
+            raise ValueError(f"找不到从 {from_lang} 到 {to_lang} 的翻译模型")
+        self.package_translation, self.pkg = find_argos_package(self.translation, from_lang, to_lang)
+        self.tokenizer = argos_tokenizer(self.pkg)
+        self.target_prefix = getattr(self.pkg, 'target_prefix', '') or ''
+        self.model = None
+        self._lock = threading.Lock()
+
+    # 加载 CTranslate2 模型；不可用时返回 None
+    def _load_model(self):
+        if self.model is not None:
+            return self.model
+        if self.tokenizer is None:
+            return None
+        with self._lock:
+            if self.model is None:
                 try:
-                    word = work_queue.get(block=False)
-                    if word is None:  # 结束信号
-                        # 把None放回队列，让其他线程也能收到结束信号
-                        work_queue.put(None)
-                        if batch:  # 处理已获取的批次
-                            break
-                        else:  # 没有要处理的单词了
-                            return
-                    batch.append(word)
-                except queue.Empty:
-                    break
-            
-            if not batch:
+                    import ctranslate2
+                except ImportError:
+                    return None
+                # 线程预算可能在 Argos 导入之后才确定，因此在创建模型时读取环境变量
+                # （Argos 自己创建模型时只使用 ARGOS_DEVICE_TYPE，不设置 inter/intra 线程数）
+                self.model = ctranslate2.Translator(
+                    str(Path(self.pkg.package_path) / 'model'),
+                    device=os.environ.get('ARGOS_DEVICE_TYPE', 'cpu'),
+                    inter_threads=int(os.environ.get('ARGOS_INTER_THREADS', 1)),
+                    intra_threads=int(os.environ.get('ARGOS_INTRA_THREADS', 0)),
+                )
+                # 让 Argos 的翻译对象也复用同一份模型
+                if self.package_translation is not None:
+                    self.package_translation.translator = self.model
+        return self.model
+
+    def translate_segments(self, segments):
+        if not segments:
+            return []
+        model = self._load_model()
+        if model is None:
+            return [self.translation.translate(segment) for segment in segments]
+        return ctranslate2_translate(model, self.tokenizer.encode, self.tokenizer.decode, segments, self.target_prefix)
+
+# 找到翻译对象背后的 Argos 包：get_translation_from_codes() 返回的是带缓存的包装对象
+# （CachedTranslation，没有 pkg 属性），先沿 underlying 解开；仍然找不到时按语言对在已安装的包中查找。
+# 返回 (持有模型的翻译对象, 包)，都可能为 None
+def find_argos_package(translation, from_lang, to_lang):
+    inner = translation
+    while getattr(inner, 'pkg', None) is None and getattr(inner, 'underlying', None) is not None:
+        inner = inner.underlying
+    pkg = getattr(inner, 'pkg', None)
+    if pkg is None:
+        inner = None
+        try:
+            import argostranslate.package
+            pkg = next((p for p in argostranslate.package.get_installed_packages()
+                        if p.from_code == from_lang and p.to_code == to_lang), None)
+        except Exception:
+            pkg = None
+    if pkg is None or getattr(pkg, 'package_path', None) is None:
+        return None, None
+    return inner, pkg
+
+# Argos 包的分词器：新版本的包自带 tokenizer，老版本（1.7 等）直接用包目录中的 SentencePiece 模型
+def argos_tokenizer(pkg):
+    if pkg is None:
+        return None
+    tokenizer = getattr(pkg, 'tokenizer', None)
+    if tokenizer is not None:
+        return tokenizer
+    sp_path = Path(pkg.package_path) / 'sentencepiece.model'
+    if not sp_path.exists():
+        return None
+    try:
+        return SentencePieceTokenizer(sp_path)
+    except ImportError:
+        return None
+
+# SentencePiece 分词器，接口与 Argos 自带的 tokenizer 相同
+class SentencePieceTokenizer:
+    def __init__(self, model_path):
+        import sentencepiece
+        self.sp = sentencepiece.SentencePieceProcessor(model_file=str(model_path))
+
+    def encode(self, text):
+        return self.sp.encode(text, out_type=str)
+
+    def decode(self, tokens):
+        return self.sp.decode(tokens)
+
+# 直接调用 CTranslate2 的后端，不需要安装 Argos：
+# path 可以是 Argos 包目录（包含 model/ 和 sentencepiece.model），也可以是 CTranslate2 模型目录（此时用 sp_model 指定分词模型）
+class CTranslate2Backend(TranslationBackend):
+    def __init__(self, path, sp_model=None, device='auto', inter_threads=1, intra_threads=0, target_prefix=''):
+        import ctranslate2
+        import sentencepiece
+        path = Path(path)
+        model_dir = path / 'model' if (path / 'model').is_dir() else path
+        sp_path = Path(sp_model) if sp_model else path / 'sentencepiece.model'
+        if not sp_path.exists():
+            raise ValueError(f"找不到 SentencePiece 分词模型: {sp_path}")
+        if device == 'auto':
+            device = 'cuda' if ctranslate2.get_cuda_device_count() > 0 else 'cpu'
+        self.sp = sentencepiece.SentencePieceProcessor(model_file=str(sp_path))
+        self.model_options = {'model_path': str(model_dir), 'device': device,
+                              'inter_threads': inter_threads, 'intra_threads': intra_threads}
+        self.model = None
+        self.target_prefix = target_prefix
+        self._lock = threading.Lock()
+
+    # 第一次翻译时创建模型
+    def _load_model(self):
+        if self.model is None:
+            with self._lock:
+                if self.model is None:
+                    import ctranslate2
+                    self.model = ctranslate2.Translator(**self.model_options)
+        return self.model
+
+    def _encode(self, text):
+        return self.sp.encode(text, out_type=str)
+
+    def _decode(self, tokens):
+        return self.sp.decode(tokens)
+
+    def translate_segments(self, segments):
+        return ctranslate2_translate(self._load_model(), self._encode, self._decode, segments, self.target_prefix)
+
+# 最小的 HTTP/1.1 长连接客户端，支持流水线：在同一连接上先连续发出多个请求，再按顺序读取响应
+class HttpConnection:
+    def __init__(self, host, port, use_ssl=False, timeout=60):
+        sock = socket.create_connection((host, port), timeout=timeout)
+        if use_ssl:
+            import ssl
+            sock = ssl.create_default_context().wrap_socket(sock, server_hostname=host)
+        self.sock = sock
+        self.fp = sock.makefile('rb')
+        self.host_header = host if port in (80, 443) else f"{host}:{port}"
+        self.closed = False
+
+    # 连续发出多个 POST 请求（流水线），不等待响应
+    def send_requests(self, path, bodies, content_type='application/json'):
+        data = []
+        for body in bodies:
+            data.append((
+                f"POST {path} HTTP/1.1\r\n"
+                f"Host: {self.host_header}\r\n"
+                f"Content-Type: {content_type}\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                f"Connection: keep-alive\r\n\r\n"
+            ).encode('ascii'))
+            data.append(body)
+        self.sock.sendall(b''.join(data))
+
+    # 按发送顺序读取一个响应，返回 (状态码, 响应体)
+    def read_response(self):
+        import http.client
+        status_line = self.fp.readline(65537)
+        if not status_line:
+            raise ConnectionError("服务器关闭了连接")
+        status = int(status_line.split(None, 2)[1])
+        headers = http.client.parse_headers(self.fp)
+        if headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            body = self._read_chunked()
+        elif headers.get('Content-Length') is not None:
+            length = int(headers['Content-Length'])
+            body = self.fp.read(length)
+            if len(body) < length:
+                raise ConnectionError("响应体不完整")
+        else:
+            # 没有长度信息时读到连接关闭为止
+            body = self.fp.read()
+            self.close()
+        if headers.get('Connection', '').lower() == 'close':
+            self.close()
+        return status, body
+
+    def _read_chunked(self):
+        chunks = []
+        while True:
+            size = int(self.fp.readline(65537).split(b';')[0].strip(), 16)
+            if size == 0:
+                # 跳过 trailer 直到空行
+                while self.fp.readline(65537) not in (b'\r\n', b'\n', b''):
+                    pass
+                return b''.join(chunks)
+            chunks.append(self.fp.read(size))
+            self.fp.readline()
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            try:
+                self.fp.close()
+                self.sock.close()
+            except OSError:
+                pass
+
+# 可以重试的临时错误（服务繁忙、网关超时等），与输入内容无关
+class TransientTranslationError(RuntimeError):
+    pass
+
+# 需要重试的 HTTP 状态码
+TRANSIENT_HTTP_STATUS = (429, 502, 503, 504)
+
+# 基于 asyncio 流的 HTTP/1.1 长连接，用法与 HttpConnection 相同，供异步模式使用
+class AsyncHttpConnection:
+    def __init__(self, reader, writer, host_header):
+        self.reader = reader
+        self.writer = writer
+        self.host_header = host_header
+        self.closed = False
+
+    @classmethod
+    async def open(cls, host, port, use_ssl=False, timeout=60):
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(host, port, ssl=True if use_ssl else None), timeout
+        )
+        return cls(reader, writer, host if port in (80, 443) else f"{host}:{port}")
+
+    async def send_requests(self, path, bodies, content_type='application/json'):
+        for body in bodies:
+            self.writer.write((
+                f"POST {path} HTTP/1.1\r\n"
+                f"Host: {self.host_header}\r\n"
+                f"Content-Type: {content_type}\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                f"Connection: keep-alive\r\n\r\n"
+            ).encode('ascii') + body)
+        await self.writer.drain()
+
+    async def read_response(self):
+        status_line = await self.reader.readline()
+        if not status_line:
+            raise ConnectionError("服务器关闭了连接")
+        status = int(status_line.split(None, 2)[1])
+        headers = {}
+        while True:
+            line = await self.reader.readline()
+            if line in (b'\r\n', b'\n', b''):
                 break
-                
-            # 批量翻译：拼接所有单词，用特殊分隔符分开
-            batch_text = "\n\n---SPLIT---\n\n".join(batch)
+            key, _, value = line.decode('iso-8859-1').partition(':')
+            headers[key.strip().lower()] = value.strip()
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size = int((await self.reader.readline()).split(b';')[0].strip(), 16)
+                if size == 0:
+                    while (await self.reader.readline()) not in (b'\r\n', b'\n', b''):
+                        pass
+                    break
+                chunks.append(await self.reader.readexactly(size))
+                await self.reader.readline()
+            body = b''.join(chunks)
+        elif 'content-length' in headers:
+            body = await self.reader.readexactly(int(headers['content-length']))
+        else:
+            body = await self.reader.read()
+            self.close()
+        if headers.get('connection', '').lower() == 'close':
+            self.close()
+        return status, body
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.writer.close()
+
+# LibreTranslate 兼容的 HTTP 后端：把翻译交给共享的翻译服务器，客户端不需要加载模型
+# 连接保持长连接并放在连接池中复用；一批文本按 chunk 条拆成多个请求，在同一连接上流水线发送
+class LibreTranslateBackend(TranslationBackend):
+    def __init__(self, from_lang, to_lang, url, api_key=None, pool_size=8, chunk=32, timeout=60, concurrency=None):
+        parsed = urllib.parse.urlsplit(url)
+        if parsed.scheme not in ('http', 'https'):
+            raise ValueError(f"不支持的翻译服务地址: {url}")
+        self.from_lang = from_lang
+        self.to_lang = to_lang
+        self.use_ssl = parsed.scheme == 'https'
+        self.host = parsed.hostname
+        self.port = parsed.port or (443 if self.use_ssl else 80)
+        self.path = parsed.path.rstrip('/') + '/translate'
+        self.api_key = api_key
+        self.pool_size = pool_size
+        self.chunk = max(1, chunk)
+        self.timeout = timeout
+        self._pool = queue.LifoQueue()
+        # 异步模式：同时占用的连接数上限，以及当前事件循环的空闲连接
+        self.max_concurrency = concurrency or pool_size
+        self._async_idle = []
+        self._async_loop = None
+
+    # 从连接池取一个长连接，没有空闲连接时新建
+    def _acquire(self):
+        try:
+            return self._pool.get_nowait()
+        except queue.Empty:
+            return HttpConnection(self.host, self.port, self.use_ssl, self.timeout)
+
+    # 用完的连接放回连接池，池满或连接已关闭时丢弃
+    def _release(self, conn):
+        if conn.closed:
+            return
+        if self._pool.qsize() < self.pool_size:
+            self._pool.put(conn)
+        else:
+            conn.close()
+
+    def _request_body(self, texts):
+        payload = {'q': texts, 'source': self.from_lang, 'target': self.to_lang, 'format': 'text'}
+        if self.api_key:
+            payload['api_key'] = self.api_key
+        return json.dumps(payload, ensure_ascii=False).encode('utf-8')
+
+    # 在一个连接上流水线发送多个请求并按顺序读取响应；
+    # 复用的空闲长连接可能已被服务器关闭，此时换新连接重发一次（翻译请求是幂等的）
+    def _exchange(self, bodies):
+        for attempt in range(2):
+            conn = self._acquire()
             try:
-                # 使用Argos Translate进行批量翻译
-                translated_text = argostranslate.translate.translate(batch_text, from_lang, to_lang)
-                
-                # 拆分结果
-                translated_parts = translated_text.split("\n\n---SPLIT---\n\n")
-                
-                # 确保结果数量与原文匹配
-                if len(translated_parts) == len(batch):
-                    for i, word in enumerate(batch):
-                        result_dict[word] = translated_parts[i]
-                else:
-                    # 回退到逐个翻译
-                    for word in batch:
-                        result_dict[word] = argostranslate.translate.translate(word, from_lang, to_lang)
-            except Exception as e:
-                print(f"批量翻译时出错: {str(e)}，回退到单词翻译模式")
-                # 回退到逐个翻译
-                for word in batch:
-                    try:
-                        result_dict[word] = argostranslate.translate.translate(word, from_lang, to_lang)
-                    except Exception as e:
-                        print(f"翻译 '{word}' 时出错: {str(e)}")
-                        result_dict[word] = f"ERROR: {str(e)}"
-            
-            # 标记所有任务完成
-            for _ in batch:
-                work_queue.task_done()
-                
+                conn.send_requests(self.path, bodies)
+                responses = [conn.read_response() for _ in bodies]
+            except (OSError, ValueError):
+                conn.close()
+                if attempt:
+                    raise
+                continue
+            self._release(conn)
+            return responses
+
+    def warm_up(self):
+        self._release(self._acquire())
+
+    def translate_segments(self, segments):
+        if not segments:
+            return []
+        chunks = [segments[i:i+self.chunk] for i in range(0, len(segments), self.chunk)]
+        responses = self._exchange([self._request_body(chunk) for chunk in chunks])
+        return self._parse_responses(chunks, responses)
+
+    # 异步版本：连接池按事件循环维护，每批仍在同一连接上流水线发送
+    async def translate_segments_async(self, segments):
+        if not segments:
+            return []
+        loop = asyncio.get_running_loop()
+        if self._async_loop is not loop:
+            self._async_idle = []
+            self._async_loop = loop
+        chunks = [segments[i:i+self.chunk] for i in range(0, len(segments), self.chunk)]
+        bodies = [self._request_body(chunk) for chunk in chunks]
+        for attempt in range(2):
+            if self._async_idle:
+                conn = self._async_idle.pop()
+            else:
+                conn = await AsyncHttpConnection.open(self.host, self.port, self.use_ssl, self.timeout)
+            try:
+                await conn.send_requests(self.path, bodies)
+                responses = [await asyncio.wait_for(conn.read_response(), self.timeout) for _ in bodies]
+            except (OSError, ValueError, asyncio.IncompleteReadError, asyncio.TimeoutError):
+                conn.close()
+                if attempt:
+                    raise
+                continue
+            if not conn.closed and len(self._async_idle) < self.max_concurrency:
+                self._async_idle.append(conn)
+            else:
+                conn.close()
+            return self._parse_responses(chunks, responses)
+
+    def _parse_responses(self, chunks, responses):
+        outputs = []
+        for chunk, (status, body) in zip(chunks, responses):
+            if status in TRANSIENT_HTTP_STATUS:
+                raise TransientTranslationError(f"翻译服务暂时不可用 ({status})")
+            if status != 200:
+                raise RuntimeError(f"翻译服务返回 {status}: {body[:200].decode('utf-8', 'replace')}")
+            translated = json.loads(body)['translatedText']
+            if isinstance(translated, str):
+                translated = [translated]
+            if len(translated) != len(chunk):
+                add_count('mismatches')
+                raise ValueError(f"翻译服务返回的结果数量不匹配: 输入 {len(chunk)} 条，输出 {len(translated)} 条")
+            outputs.extend(translated)
+        return outputs
+
+    def close(self):
+        for conn in self._async_idle:
+            conn.close()
+        self._async_idle = []
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                return
+
+# 假翻译后端：用于基准测试和演练，不加载任何模型，输出可预测
+# 耗时 = 每批固定开销 + 每 token 延迟 × 填充后的 token 数（批内最长条目 × 条目数），
+# 与真实模型一样在等待期间释放 GIL；fail_on 指定的子串出现在输入中时整批报错，用于模拟坏条目
+class FakeBackend(TranslationBackend):
+    def __init__(self, from_lang, to_lang, token_ms=0.5, batch_ms=2.0, fail_on=None):
+        self.from_lang = from_lang
+        self.to_lang = to_lang
+        self.token_ms = token_ms
+        self.batch_ms = batch_ms
+        self.fail_on = fail_on
+
+    def warm_up(self):
+        pass
+
+    def translate_segments(self, segments):
+        if not segments:
+            return []
+        if self.fail_on and any(self.fail_on in segment for segment in segments):
+            raise RuntimeError(f"输入中包含 {self.fail_on!r}")
+        padded_tokens = max(estimate_tokens(segment) for segment in segments) * len(segments)
+        time.sleep((self.batch_ms + self.token_ms * padded_tokens) / 1000)
+        return [f"[{self.to_lang}] {segment}" for segment in segments]
+
+# 解析翻译后端描述 "名称[:键=值,键=值]"，例如 "fake:token_ms=0.2,batch_ms=1"
+def parse_backend_spec(spec):
+    name, _, option_text = spec.partition(':')
+    options = {}
+    for item in option_text.split(','):
+        if item.strip():
+            key, _, value = item.partition('=')
+            options[key.strip()] = value.strip()
+    return name.strip().lower(), options
+
+# 按后端描述创建翻译后端
+def create_translator(backend, from_lang, to_lang):
+    name, options = parse_backend_spec(backend)
+    if name == 'argos':
+        return ArgosBackend(from_lang, to_lang)
+    if name == 'ct2':
+        if 'path' not in options:
+            raise ValueError("ct2 后端需要指定 path=<模型目录>")
+        return CTranslate2Backend(
+            options['path'],
+            sp_model=options.get('sp_model'),
+            device=options.get('device', os.environ.get('ARGOS_DEVICE_TYPE', 'auto')),
+            inter_threads=int(options.get('inter_threads', os.environ.get('ARGOS_INTER_THREADS', 1))),
+            intra_threads=int(options.get('intra_threads', os.environ.get('ARGOS_INTRA_THREADS', 0))),
+            target_prefix=options.get('target_prefix', ''),
+        )
+    if name in ('libretranslate', 'http'):
+        if 'url' not in options:
+            raise ValueError("libretranslate 后端需要指定 url=<服务地址>")
+        return LibreTranslateBackend(
+            from_lang, to_lang, options['url'],
+            api_key=options.get('api_key'),
+            pool_size=int(options.get('pool', 8)),
+            chunk=int(options.get('chunk', 32)),
+            timeout=float(options.get('timeout', 60)),
+            concurrency=int(options['concurrency']) if 'concurrency' in options else None,
+        )
+    if name == 'fake':
+        return FakeBackend(
+            from_lang, to_lang,
+            token_ms=float(options.get('token_ms', 0.5)),
+            batch_ms=float(options.get('batch_ms', 2.0)),
+            fail_on=options.get('fail_on'),
+        )
+    raise ValueError(f"未知的翻译后端: {name}")
+
+# 后端的模型标识：后端名称加上决定译文的模型位置（ct2 的模型目录和分词设置、HTTP 服务的地址），
+# 用作翻译缓存的模型版本和自动调优配置档案的键。api_key、连接池、超时、并发等选项不影响译文，不计入；
+# 地址中的用户名密码和查询参数也去掉，避免密钥写进缓存数据库和配置档案
+def backend_identity(spec):
+    name, options = parse_backend_spec(spec)
+    if name == 'ct2':
+        parts = [f"path={os.path.abspath(options['path'])}" if 'path' in options else '']
+        if options.get('sp_model'):
+            parts.append(f"sp_model={os.path.abspath(options['sp_model'])}")
+        if options.get('target_prefix'):
+            parts.append(f"target_prefix={options['target_prefix']}")
+        return 'ct2:' + ','.join(parts)
+    if name in ('libretranslate', 'http'):
+        url = urllib.parse.urlsplit(options.get('url', ''))
+        host = url.hostname or ''
+        if url.port:
+            host = f"{host}:{url.port}"
+        return 'libretranslate:url=' + urllib.parse.urlunsplit((url.scheme, host, url.path.rstrip('/'), '', ''))
+    return name
+
+# 每个进程内按 (后端, 语言对) 缓存已加载的翻译器，线程之间共享
+# 批量翻译时（见 use_single_translator）每个进程只常驻一个翻译器：换到另一个语言对时先关闭并丢弃之前的，
+# 多个目标语言依次翻译时，每个进程同一时间只占用一个模型的内存
+_translators = {}
+_translators_lock = threading.Lock()
+_single_translator = False
+
+def get_translator(from_lang, to_lang, backend='argos'):
+    key = (backend, from_lang, to_lang)
+    translator = _translators.get(key)
+    if translator is None:
+        with _translators_lock:
+            translator = _translators.get(key)
+            if translator is None:
+                if _single_translator:
+                    release_translators()
+                translator = create_translator(backend, from_lang, to_lang)
+                _translators[key] = translator
+    return translator
+
+# 关闭并丢弃本进程中已加载的翻译器，之后 get_translator 重新创建（调用方需在没有批次使用它们时调用）
+def release_translators():
+    for translator in _translators.values():
+        try:
+            translator.close()
         except Exception as e:
-            print(f"线程处理时出错: {str(e)}")
-            break
+            print(f"释放翻译器时出错: {str(e)}")
+    _translators.clear()
 
-# 进程池翻译函数
-def translate_batch(batch, from_lang, to_lang):
-    result = {}
-    # 批量翻译：拼接所有单词，用特殊分隔符分开
-    batch_text = "\n\n---SPLIT---\n\n".join(batch)
+# 开启后每个进程只常驻一个翻译器；服务模式（--serve）同时服务多个语言对，不开启
+def use_single_translator(enabled=True):
+    global _single_translator
+    _single_translator = enabled
+
+# 进程池初始化函数：每个工作进程启动时加载一次模型，翻译器保存在进程内的 _translators 中，
+# 换到另一个目标语言的批次时释放之前的模型再加载新的
+# cpu_sets 不为空时，把工作进程绑定到它的槽位对应的一组核心（接替回收进程的新进程沿用原来的槽位）
+def init_worker(from_lang, to_lang, backend='argos', cpu_sets=None, slot=0):
+    if cpu_sets:
+        try:
+            os.sched_setaffinity(0, cpu_sets[slot % len(cpu_sets)])
+        except (AttributeError, OSError) as e:
+            print(f"工作进程 {os.getpid()} 绑定 CPU 时出错: {str(e)}")
+    use_single_translator()
     try:
-        # 使用Argos Translate进行批量翻译
-        translated_text = argostranslate.translate.translate(batch_text, from_lang, to_lang)
-        
-        # 拆分结果
-        translated_parts = translated_text.split("\n\n---SPLIT---\n\n")
-        
-        # 确保结果数量与原文匹配
-        if len(translated_parts) == len(batch):
-            for i, word in enumerate(batch):
-                result[word] = translated_parts[i]
-        else:
-            # 回退到逐个翻译
-            for word in batch:
-                result[word] = argostranslate.translate.translate(word, from_lang, to_lang)
+        get_translator(from_lang, to_lang, backend).warm_up()
     except Exception as e:
-        print(f"批量翻译时出错: {str(e)}，回退到单词翻译模式")
-        # 回退到逐个翻译
-        for word in batch:
+        print(f"工作进程 {os.getpid()} 预加载模型时出错: {str(e)}")
+
+# 工作进程的主循环：初始化（加载模型）后报告内存占用，然后逐个执行主进程分来的任务，收到 None 时退出
+# conn 为该进程独用的双向管道，任务和结果都经它传递；probe 为每批之后测量内存的函数
+def pool_worker_main(worker_id, slot, conn, initializer, initargs, probe=current_rss_mb):
+    try:
+        if initializer is not None:
+            initializer(*initargs, slot)
+        conn.send(('ready', worker_id, probe(), memory_breakdown()))
+        while True:
+            item = conn.recv()
+            if item is None:
+                return
+            task_id, func, arg = item
+            try:
+                outcome = (True, func(arg))
+            except Exception as e:
+                outcome = (False, e)
             try:
-                result[word] = argostranslate.translate.translate(word, from_lang, to_lang)
+                conn.send(('result', worker_id, task_id, *outcome, probe()))
             except Exception as e:
-                print(f"翻译 '{word}' 时出错: {str(e)}")
-                result[word] = f"ERROR: {str(e)}"
-    return result
+                # 结果无法序列化（例如异常对象带有不可序列化的属性）时改为报告错误信息
+                conn.send(('result', worker_id, task_id, False, RuntimeError(f"无法传回批次结果: {str(e)}"), probe()))
+    except (KeyboardInterrupt, EOFError, BrokenPipeError):
+        # Ctrl+C 由主进程处理，主进程退出后管道关闭，工作进程安静退出
+        return
 
-# 主函数
-def main():
-    # 解析命令行参数
-    args = parse_arguments()
+# 可回收工作进程的进程池，接口与 multiprocessing.Pool 的 imap_unordered/close/join/terminate 相同
+# - 每个工作进程同时只处理一个批次，主进程记录每个批次在哪个进程中
+# - 每完成一个批次，工作进程报告自己的 RSS；完成 max_tasks 个批次或 RSS 超过 max_rss_mb 的进程交回结果后退出，
+#   由新进程接替（重新加载模型），其他进程中正在处理的批次不受影响
+# - 工作进程意外退出（例如被 OOM killer 杀掉）时，它手上的批次交给其他进程重做，而不是让整个运行卡住；
+#   每个进程用自己的管道收发，主进程读到管道关闭就知道进程已退出，一个进程死在写入途中不会堵住其他进程
+# - max_memory_mb 为整个运行（主进程 + 所有工作进程）的内存预算：先启动一个进程测出加载模型后的占用，
+#   再按预算减少进程数；没有指定 max_rss_mb 时，单个进程的上限为预算平均分给每个进程的份额
+# - report_memory 为 True 时等所有工作进程加载完模型，打印每个进程共享/独占的内存
+class WorkerPool:
+    # 同一个批次连续导致多少次工作进程退出后放弃
+    MAX_CRASHES_PER_TASK = 3
+    # 按实测占用估算进程数时，给推理过程中的内存增长预留的余量
+    GROWTH_HEADROOM = 1.25
+
+    def __init__(self, processes, initializer=None, initargs=(), max_tasks=None, max_rss_mb=None, max_memory_mb=None,
+                 report_memory=False):
+        self._ctx = mp.get_context()
+        self._probe = current_rss_mb
+        self._initializer = initializer
+        self._initargs = initargs
+        self._workers = {}   # worker_id -> {'process', 'conn', 'slot', 'done', 'rss', 'memory', 'ready'}
+        self._retired = []   # 已通知退出、尚未 join 的进程
+        self._next_id = 0
+        self._closed = False
+        self.max_tasks = max_tasks
+        self.max_rss_mb = max_rss_mb
+        self.processes = max(1, processes)
+        self.recycled = 0
+        self.crashed = 0
+        if max_memory_mb:
+            self._fit_memory(max_memory_mb)
+        for slot in range(self.processes):
+            if not any(worker['slot'] == slot for worker in self._workers.values()):
+                self._spawn(slot)
+        if report_memory:
+            self._wait_ready()
+            self.memory_report()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.terminate()
+
+    def _spawn(self, slot):
+        worker_id = self._next_id
+        self._next_id += 1
+        conn, child_conn = self._ctx.Pipe()
+        process = self._ctx.Process(target=pool_worker_main, daemon=True,
+                                    args=(worker_id, slot, child_conn, self._initializer, self._initargs, self._probe))
+        process.start()
+        # 主进程不保留子进程一端，子进程退出后这一端随之关闭，主进程读到 EOF
+        child_conn.close()
+        self._workers[worker_id] = {'process': process, 'conn': conn, 'slot': slot, 'done': 0, 'rss': None,
+                                    'memory': None, 'ready': False}
+        return worker_id
+
+    # 等待工作进程发来的消息，返回 [(worker_id, 消息)]；管道已关闭（进程已退出）时消息为 None
+    def _receive(self, timeout=1.0):
+        conns = {worker['conn']: worker_id for worker_id, worker in self._workers.items()}
+        messages = []
+        for conn in mp.connection.wait(list(conns), timeout):
+            try:
+                messages.append((conns[conn], conn.recv()))
+            except (EOFError, OSError):
+                messages.append((conns[conn], None))
+        return messages
+
+    # 从进程池中移除已退出的工作进程，返回退出码
+    def _remove(self, worker_id):
+        worker = self._workers.pop(worker_id)
+        worker['conn'].close()
+        worker['process'].join(5)
+        if worker['process'].exitcode is None:
+            worker['process'].terminate()
+            worker['process'].join()
+        return worker['process'].exitcode
+
+    # 处理工作进程加载完模型后发来的 ready 消息
+    def _on_ready(self, message):
+        _, worker_id, rss, breakdown = message
+        worker = self._workers.get(worker_id)
+        if worker is not None:
+            worker['rss'] = rss
+            worker['memory'] = breakdown
+            worker['ready'] = True
+
+    # 等待当前所有工作进程加载完模型
+    def _wait_ready(self):
+        while not all(worker['ready'] for worker in self._workers.values()):
+            for worker_id, message in self._receive():
+                if message is None:
+                    pid = self._workers[worker_id]['process'].pid
+                    raise RuntimeError(f"工作进程 {pid} 在加载模型时退出（退出码 {self._remove(worker_id)}）")
+                if message[0] == 'ready':
+                    self._on_ready(message)
+
+    # 打印主进程和各工作进程加载模型后共享/独占的内存；PSS 之和是整个进程池实际占用的物理内存
+    def memory_report(self):
+        parent = memory_breakdown()
+        if parent is None:
+            print("当前系统不支持读取 /proc/self/smaps_rollup，无法统计共享内存")
+            return
+        print("内存占用（加载模型后，MB）：")
+        print(f"  主进程 {os.getpid()}: RSS {parent['rss']:.0f}，共享 {parent['shared']:.0f}，独占 {parent['private']:.0f}，PSS {parent['pss']:.0f}")
+        total_rss = parent['rss']
+        total_pss = parent['pss']
+        for worker in sorted(self._workers.values(), key=lambda item: item['slot']):
+            memory = worker['memory']
+            if not memory:
+                continue
+            print(f"  工作进程 {worker['process'].pid}: RSS {memory['rss']:.0f}，共享 {memory['shared']:.0f}，"
+                  f"独占 {memory['private']:.0f}，PSS {memory['pss']:.0f}")
+            total_rss += memory['rss']
+            total_pss += memory['pss']
+        print(f"  合计：RSS 之和 {total_rss:.0f}，实际占用约 {total_pss:.0f}（PSS 之和），共享节省约 {total_rss - total_pss:.0f}")
+
+    # 先启动一个工作进程，等它加载完模型后按实测占用计算预算内能容纳的进程数
+    def _fit_memory(self, max_memory_mb):
+        worker_id = self._spawn(0)
+        while not self._workers[worker_id]['ready']:
+            for _, message in self._receive():
+                if message is None:
+                    self._remove(worker_id)
+                    raise RuntimeError("工作进程在加载模型时退出，无法测量内存占用")
+                if message[0] == 'ready':
+                    self._on_ready(message)
+        footprint = self._workers[worker_id]['rss']
+        if not footprint:
+            print("无法测量工作进程的内存占用，--max_memory 不生效")
+            return
+        available = max_memory_mb - (current_rss_mb() or 0)
+        fit = max(1, int(available / (footprint * self.GROWTH_HEADROOM)))
+        print(f"单个工作进程加载模型后占用 {footprint:.0f} MB，内存预算 {max_memory_mb:.0f} MB 内最多容纳 {fit} 个进程")
+        if fit < self.processes:
+            print(f"进程数从 {self.processes} 调整为 {fit}")
+            self.processes = fit
+        if not self.max_rss_mb:
+            self.max_rss_mb = available / self.processes
+            print(f"单个工作进程的内存上限为 {self.max_rss_mb:.0f} MB，超过后由新进程接替")
+
+    # 工作进程交回一个批次后，按完成的批次数和 RSS 决定是否让它退出并启动新进程接替
+    def _maybe_recycle(self, worker_id):
+        worker = self._workers[worker_id]
+        reason = None
+        if self.max_tasks and worker['done'] >= self.max_tasks:
+            reason = f"已处理 {worker['done']} 个批次"
+        elif self.max_rss_mb and worker['rss'] and worker['rss'] > self.max_rss_mb:
+            reason = f"RSS {worker['rss']:.0f} MB 超过上限 {self.max_rss_mb:.0f} MB"
+        if reason is None:
+            return
+        try:
+            worker['conn'].send(None)
+        except OSError:
+            pass
+        worker['conn'].close()
+        self._retired.append(worker['process'])
+        del self._workers[worker_id]
+        self.recycled += 1
+        print(f"回收工作进程 {worker['process'].pid}（{reason}），由新进程接替")
+        self._spawn(worker['slot'])
+
+    # 处理意外退出的工作进程（管道已关闭）：它手上的批次放回队首交给其他进程，并启动新进程补上
+    def _reap(self, worker_id, in_flight, pending, crashes):
+        worker = self._workers[worker_id]
+        exitcode = self._remove(worker_id)
+        self.crashed += 1
+        item = in_flight.pop(worker_id, None)
+        print(f"工作进程 {worker['process'].pid} 意外退出（退出码 {exitcode}，可能被 OOM killer 杀掉）"
+              + ("，它处理中的批次交给其他进程重做" if item else ""))
+        if item is not None:
+            crashes[item[0]] += 1
+            if crashes[item[0]] >= self.MAX_CRASHES_PER_TASK:
+                raise RuntimeError(f"同一批次已导致 {crashes[item[0]]} 个工作进程退出，放弃运行")
+            pending.appendleft(item)
+        if not self._closed:
+            self._spawn(worker['slot'])
+
+    def imap_unordered(self, func, iterable):
+        tasks = iter(iterable)
+        pending = collections.deque()   # 需要重做的 (task_id, arg)
+        in_flight = {}                  # worker_id -> (task_id, arg)
+        crashes = collections.Counter()
+        next_task = 0
+        exhausted = False
+        while True:
+            self._retired = [process for process in self._retired if process.exitcode is None]
+            # 给空闲的工作进程各分一个批次
+            for worker_id, worker in list(self._workers.items()):
+                if worker_id in in_flight:
+                    continue
+                if pending:
+                    item = pending.popleft()
+                elif not exhausted:
+                    try:
+                        item = (next_task, next(tasks))
+                    except StopIteration:
+                        exhausted = True
+                        continue
+                    next_task += 1
+                else:
+                    continue
+                in_flight[worker_id] = item
+                try:
+                    worker['conn'].send((item[0], func, item[1]))
+                except OSError:
+                    # 进程已经退出，批次放回队首，由 _reap 启动新进程
+                    in_flight.pop(worker_id)
+                    pending.appendleft(item)
+                    self._reap(worker_id, in_flight, pending, crashes)
+            if not in_flight:
+                if pending or not exhausted:
+                    raise RuntimeError("进程池中没有可用的工作进程")
+                return
+            for worker_id, message in self._receive():
+                if worker_id not in self._workers:
+                    continue
+                if message is None:
+                    self._reap(worker_id, in_flight, pending, crashes)
+                    continue
+                if message[0] == 'ready':
+                    self._on_ready(message)
+                    continue
+                _, worker_id, task_id, ok, value, rss = message
+                in_flight.pop(worker_id, None)
+                self._workers[worker_id]['done'] += 1
+                self._workers[worker_id]['rss'] = rss
+                self._maybe_recycle(worker_id)
+                if not ok:
+                    raise value
+                yield value
+
+    # 各工作进程最近一次报告的 RSS（MB），按 pid 索引
+    def worker_rss(self):
+        return {worker['process'].pid: worker['rss'] for worker in self._workers.values() if worker['rss'] is not None}
+
+    def close(self):
+        self._closed = True
+        for worker in self._workers.values():
+            try:
+                worker['conn'].send(None)
+            except OSError:
+                pass
+
+    def join(self):
+        for process in [worker['process'] for worker in self._workers.values()] + self._retired:
+            process.join()
+        for worker in self._workers.values():
+            worker['conn'].close()
+        self._workers = {}
+        self._retired = []
+
+    def terminate(self):
+        self._closed = True
+        for process in [worker['process'] for worker in self._workers.values()] + self._retired:
+            if process.exitcode is None:
+                process.terminate()
+            process.join()
+        for worker in self._workers.values():
+            worker['conn'].close()
+        self._workers = {}
+        self._retired = []
+
+# 创建预热好的进程池；max_tasks/max_rss_mb/max_memory_mb/report_memory 见 WorkerPool
+def create_worker_pool(processes, from_lang, to_lang, backend='argos', cpu_sets=None,
+                       max_tasks=None, max_rss_mb=None, max_memory_mb=None, report_memory=False):
+    return WorkerPool(processes, initializer=init_worker, initargs=(from_lang, to_lang, backend, cpu_sets),
+                      max_tasks=max_tasks, max_rss_mb=max_rss_mb, max_memory_mb=max_memory_mb, report_memory=report_memory)
+
+# 二分定位失败条目：整批失败时拆成两半分别重试，坏条目只需 O(log n) 次批量调用就能被隔离
+# 成功的译文写入 translated，失败的条目及错误信息写入 failures；
+# 临时错误（见 call_with_retry_sync）先整批重试，重试用完仍失败时才二分
+def translate_with_bisect(segments, translator, translated, failures, retries=3, retry_delay=0.5):
+    try:
+        outputs = call_with_retry_sync(translator, segments, retries, retry_delay)
+    except Exception as e:
+        if len(segments) == 1:
+            print(f"翻译 '{segments[0]}' 时出错: {str(e)}")
+            failures[segments[0]] = str(e)
+            add_count('failed_items')
+            return
+        add_count('bisect_splits')
+        mid = len(segments) // 2
+        translate_with_bisect(segments[:mid], translator, translated, failures, retries, retry_delay)
+        translate_with_bisect(segments[mid:], translator, translated, failures, retries, retry_delay)
+        return
+    for segment, output in zip(segments, outputs):
+        translated[segment] = output
+
+# 多线程/多进程模式：带重试的单次批量调用，与异步模式的 call_with_retry 相同，
+# 只重试与内容无关的临时错误（网络错误、超时、服务繁忙），退避时间带随机抖动
+def call_with_retry_sync(translator, segments, retries, base_delay):
+    for attempt in range(retries + 1):
+        try:
+            return timed_translate_segments(translator, segments)
+        except (OSError, TransientTranslationError) as e:
+            if attempt == retries:
+                raise
+            add_count('retries')
+            delay = random.uniform(0, base_delay * (2 ** attempt))
+            print(f"批量翻译临时出错: {str(e)}，{delay:.2f} 秒后重试")
+            time.sleep(delay)
+
+# 调用后端翻译一批并计时；后端没有自己细分阶段耗时时（HTTP、假后端等），整个调用计入 inference
+def timed_translate_segments(translator, segments):
+    add_count('model_calls')
+    before = trace_stage_total(MODEL_STAGES)
+    start = time.perf_counter()
+    try:
+        return translator.translate_segments(segments)
+    finally:
+        if trace_stage_total(MODEL_STAGES) == before:
+            add_stage('inference', time.perf_counter() - start)
+
+# 翻译一批单词：先查持久化缓存，只把未命中的单词交给模型，结果写回缓存
+# 返回 (译文字典, 失败字典)，失败的条目不会出现在译文中
+def translate_words(batch, from_lang, to_lang, cache=None, backend='argos', retries=3, retry_delay=0.5):
+    start = time.perf_counter()
+    result = cache.get_many(batch) if cache is not None else {}
+    add_stage('cache_read', time.perf_counter() - start)
+    add_count('segments', len(batch))
+    add_count('cache_hits', len(result))
+    failures = {}
+    pending = [word for word in batch if word not in result]
+    if not pending:
+        return result, failures
     
-    # 检查GPU状态
-    check_gpu_status()
+    translated = {}
+    try:
+        translator = get_translator(from_lang, to_lang, backend)
+    except Exception as e:
+        print(f"加载翻译模型时出错: {str(e)}")
+        return result, {word: str(e) for word in pending}
+    # 整批一次前向推理，输出与输入一一对应；出错时二分重试
+    translate_with_bisect(pending, translator, translated, failures, retries, retry_delay)
     
-    # 获取输入文件和输出文件名
-    input_file = args.input_file if hasattr(args, 'input_file') else sys.argv[1]
-    input_path = Path(input_file)
-    output_file = f"translated_{input_path.stem}_{args.from_lang}_to_{args.to_lang}.csv"
+    # 只缓存成功的翻译，出错的条目下次运行时重试
+    if cache is not None:
+        start = time.perf_counter()
+        try:
+            cache.put_many(translated)
+        except sqlite3.Error as e:
+            print(f"写入翻译缓存时出错: {str(e)}")
+        add_stage('cache_write', time.perf_counter() - start)
+    result.update(translated)
+    return result, failures
+
+# 估算文本的 token 数：按单词和标点粗略计数，子词切分后大致成正比
+_token_pattern = re.compile(r'\w+|[^\w\s]')
+
+def estimate_tokens(text):
+    return max(1, len(_token_pattern.findall(text)))
+
+# 按长度分桶组批：先按估算 token 数把长度相同的条目归入同一桶，再从短到长按 token 预算切分批次
+# 一批的代价按 批内最长条目 × 条目数 计算（模型会把整批填充到最长条目），
+# 因此 "CPU" 这类短词不会再和长短语挤在同一批里白白付出填充和解码代价。
+# window 不为空时每 window 个条目单独分桶，批次大体按输入顺序调度，配合流式模式的重排缓冲区尽早写出结果
+def make_batches(words, token_budget, max_batch_size=None, window=None):
+    if window and len(words) > window:
+        return [batch for start in range(0, len(words), window)
+                for batch in make_batches(words[start:start+window], token_budget, max_batch_size)]
+    buckets = {}
+    for word in words:
+        buckets.setdefault(estimate_tokens(word), []).append(word)
     
-    # 检查并安装翻译包
-    install_translation_package(args.from_lang, args.to_lang)
+    batches = []
+    current = []
+    longest = 0
+    for length in sorted(buckets):
+        for word in buckets[length]:
+            new_longest = max(longest, length)
+            too_costly = new_longest * (len(current) + 1) > token_budget
+            too_many = max_batch_size is not None and len(current) >= max_batch_size
+            if current and (too_costly or too_many):
+                batches.append(current)
+                current = []
+                new_longest = length
+            current.append(word)
+            longest = new_longest
+    if current:
+        batches.append(current)
     
-    # 读取英文单词文件
+    # 代价大的批次先调度，避免长批次拖在最后拉长尾部时间
+    batches.sort(key=lambda batch: estimate_tokens(batch[-1]) * len(batch), reverse=True)
+    return batches
+
+# 读取结果 CSV 中的 (原文, 译文) 行，不依赖 pandas
+def read_csv_rows(path):
+    if not os.path.exists(path):
+        return
+    with open(path, 'r', encoding='utf-8-sig', newline='') as file:
+        reader = csv.reader(file)
+        next(reader, None)  # 跳过表头
+        for row in reader:
+            if len(row) >= 2:
+                yield row[0], row[1]
+
+# 支持的输出格式及其扩展名
+OUTPUT_FORMATS = {'csv': '.csv', 'jsonl': '.jsonl', 'parquet': '.parquet', 'flashcard': '.txt'}
+
+# Parquet 输出每个行组的行数，写入时每次只在内存中保留一个行组
+PARQUET_ROW_GROUP = 65536
+
+# 闪卡格式的字段中不能有制表符和换行
+def flashcard_field(text):
+    return re.sub(r'[\t\r\n]+', ' ', text)
+
+# 把若干行写入已打开的文本输出文件；header 为 True 时先写表头（只有 CSV 有表头）
+def write_text_rows(file, fmt, rows, header=False):
+    count = 0
+    if fmt == 'csv':
+        writer = csv.writer(file, lineterminator='\n')
+        if header:
+            writer.writerow(['原文', '翻译'])
+        for source, translation in rows:
+            writer.writerow([source, translation])
+            count += 1
+    elif fmt == 'jsonl':
+        for source, translation in rows:
+            file.write(json.dumps({'source': source, 'translation': translation}, ensure_ascii=False) + '\n')
+            count += 1
+    else:
+        # 闪卡导入格式：每行 "原文<Tab>译文"，没有表头，Anki、Quizlet 等都能直接导入，
+        # 只取第一列时就是不背单词等应用使用的词表
+        for source, translation in rows:
+            file.write(f"{flashcard_field(source)}\t{flashcard_field(translation)}\n")
+            count += 1
+    return count
+
+# 文本输出格式的文件编码：CSV 带 BOM 方便 Excel 打开，其他格式不带
+def output_encoding(fmt):
+    return 'utf-8-sig' if fmt == 'csv' else 'utf-8'
+
+# 把 (原文, 译文) 行写成 Parquet 文件（source、translation 两列），按行组分批写入，内存有界
+def write_parquet_rows(path, rows):
     try:
-        with open(input_file, 'r', encoding='utf-8') as file:
-            words = file.readlines()
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError("输出 Parquet 需要安装 pyarrow: pip install pyarrow")
+    schema = pa.schema([('source', pa.string()), ('translation', pa.string())])
+    count = 0
+    with pq.ParquetWriter(path, schema) as writer:
+        for chunk in iter_chunks(rows, PARQUET_ROW_GROUP):
+            writer.write_table(pa.table({
+                'source': [source for source, _ in chunk],
+                'translation': [translation for _, translation in chunk],
+            }, schema=schema))
+            count += len(chunk)
+    with open(path, 'rb') as file:
+        os.fsync(file.fileno())
+    return count
+
+# 重写整个输出文件并落盘，返回写出的行数（原子替换由调用方负责）
+def write_output_rows(path, fmt, rows):
+    if fmt == 'parquet':
+        return write_parquet_rows(path, rows)
+    with open(path, 'w', encoding=output_encoding(fmt), newline='') as file:
+        count = write_text_rows(file, fmt, rows, header=True)
+        file.flush()
+        os.fsync(file.fileno())
+    return count
+
+# Parquet 输出的分片：流式模式下输出是一个目录，每块追加一个 part-NNNNN.parquet，普通模式下是单个文件
+def parquet_parts(path):
+    if os.path.isdir(path):
+        return sorted(os.path.join(path, name) for name in os.listdir(path)
+                      if name.startswith('part-') and name.endswith('.parquet'))
+    return [path] if os.path.exists(path) else []
+
+# 追加若干行并落盘，返回输出的长度：文本格式为文件字节数，Parquet 为目录中的分片数；
+# sync 为 False 时只追加不落盘，之后再以 sync=True 调用（可以不带行）时一起落盘
+def append_output_rows(path, fmt, rows, sync=True):
+    if fmt == 'parquet':
+        os.makedirs(path, exist_ok=True)
+        parts = len(parquet_parts(path))
+        if rows:
+            write_parquet_rows(os.path.join(path, f'part-{parts:05d}.parquet'), rows)
+            parts += 1
+        return parts
+    if not rows and not sync:
+        return os.path.getsize(path) if os.path.exists(path) else 0
+    if not rows and not os.path.exists(path):
+        return 0
+    with open(path, 'a', encoding=output_encoding(fmt), newline='') as file:
+        if rows:
+            write_text_rows(file, fmt, rows, header=file.tell() == 0)
+        file.flush()
+        if sync:
+            # 也把之前不落盘追加的内容一起落盘
+            os.fsync(file.fileno())
+        return os.fstat(file.fileno()).st_size
+
+# 把输出截断到 append_output_rows 返回的长度，丢弃之后写出的内容
+def truncate_output(path, fmt, size):
+    if fmt == 'parquet':
+        for part in parquet_parts(path)[size:] if os.path.isdir(path) else []:
+            os.remove(part)
+    elif os.path.exists(path) and os.path.getsize(path) > size:
+        with open(path, 'r+b') as file:
+            file.truncate(size)
+
+# 读取任意格式输出中的 (原文, 译文) 行
+def read_output_rows(path, fmt):
+    if fmt == 'csv':
+        yield from read_csv_rows(path)
+    elif fmt == 'parquet':
+        for source_batch, translation_batch in read_parquet_columns(path, ['source', 'translation']):
+            yield from zip(source_batch, translation_batch)
+    elif os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as file:
+            for line in file:
+                if fmt == 'jsonl':
+                    try:
+                        row = json.loads(line)
+                        yield row['source'], row['translation']
+                    except (ValueError, KeyError, TypeError):
+                        continue
+                else:
+                    source, sep, translation = line.rstrip('\n').partition('\t')
+                    if sep:
+                        yield source, translation
+
+# 按行组读取 Parquet 输出中指定的列，只解码需要的列
+def read_parquet_columns(path, columns):
+    parts = parquet_parts(path)
+    if not parts:
+        return
+    import pyarrow.parquet as pq
+    for part in parts:
+        for batch in pq.ParquetFile(part).iter_batches(columns=columns):
+            yield [batch.column(name).to_pylist() for name in columns]
+
+# 续跑时只读取输出中的原文列（Parquet 不解码译文列）
+def read_output_keys(path, fmt):
+    if fmt == 'parquet':
+        for (sources,) in read_parquet_columns(path, ['source']):
+            yield from sources
+    else:
+        for source, _ in read_output_rows(path, fmt):
+            yield source
+
+# 读取结果日志中的 (输入行号, 原文, 译文)；崩溃时最后一行可能只写了一半，直接跳过。
+# 旧版日志没有行号，行号为 None
+def read_log_entries(path):
+    if not os.path.exists(path):
+        return
+    with open(path, 'r', encoding='utf-8') as file:
+        for line in file:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            if not isinstance(entry, list):
+                continue
+            if len(entry) == 3:
+                yield tuple(entry)
+            elif len(entry) == 2:
+                yield None, entry[0], entry[1]
+
+# 读取结果日志中的 (原文, 译文)
+def read_log_rows(path):
+    for _, source, translation in read_log_entries(path):
+        yield source, translation
+
+# 截掉日志末尾崩溃时只写了一半的行，否则之后追加的第一条会接在半行后面一起作废
+def trim_torn_line(path):
+    if not os.path.exists(path):
+        return
+    with open(path, 'r+b') as file:
+        size = file.seek(0, os.SEEK_END)
+        if size == 0:
+            return
+        file.seek(size - 1)
+        if file.read(1) == b'\n':
+            return
+        # 从末尾往前找最后一个换行
+        end = size
+        while end > 0:
+            start = max(0, end - 65536)
+            file.seek(start)
+            newline = file.read(end - start).rfind(b'\n')
+            if newline >= 0:
+                file.truncate(start + newline + 1)
+                return
+            end = start
+        file.truncate(0)
+
+# 读取压缩时溢出到磁盘的一段已排序日志
+def read_log_run(path):
+    with open(path, 'r', encoding='utf-8') as file:
+        for line in file:
+            yield tuple(json.loads(line))
+
+# 崩溃安全的结果写入器
+# 每完成一批就把结果追加到 <输出文件>.log（每行一个 [输入行号, 原文, 译文] JSON，写入后 fsync），
+# 结果不在内存中累积；日志条目数达到 compact_every 且不少于输出已有行数时（保证重写输出的总代价是线性的），
+# 把日志按行号排序（每 compact_every 条一段，多段时溢出到磁盘），与按输入顺序排列的输出逐行归并成新输出，
+# 写临时文件后原子替换，再删除日志；内存只占一段日志，不随输出大小增长。
+# 中途崩溃或 Ctrl-C 最多丢失正在翻译的批次；续跑时只读取输出的原文列和压缩之后的日志尾部
+class ResultWriter:
+    def __init__(self, output_file, words, compact_every=10000, fmt='csv'):
+        self.output_file = output_file
+        self.fmt = fmt
+        self.log_file = output_file + '.log'
+        self.failure_file = output_file + '.failures.csv'
+        self.failure_count = 0
+        self._failure_log = None
+        # 每个原文在输入中的行号：只出现一次的是整数，重复出现的是列表
+        self.lines = {}
+        for line, word in enumerate(words):
+            previous = self.lines.get(word)
+            if previous is None:
+                self.lines[word] = line
+            elif isinstance(previous, list):
+                previous.append(line)
+            else:
+                self.lines[word] = [previous, line]
+        self.compact_every = compact_every
+        self.compacted_count = 0
+        self.log_count = 0
+        self.new_count = 0
+        self._log = None
+        self._lock = threading.Lock()
+
+    # 原文在输入中的所有行号
+    def _lines_of(self, word):
+        lines = self.lines.get(word)
+        if lines is None:
+            return []
+        return lines if isinstance(lines, list) else [lines]
+
+    # 读取续跑状态，返回已翻译的原文集合；上次运行的失败报告作废（失败条目本次会重试）
+    def load_done(self):
+        if os.path.exists(self.failure_file):
+            os.remove(self.failure_file)
+        trim_torn_line(self.log_file)
+        done = set()
+        for source in read_output_keys(self.output_file, self.fmt):
+            done.add(source)
+            self.compacted_count += 1
+        for _, source, _ in read_log_entries(self.log_file):
+            done.add(source)
+            self.log_count += 1
+        return done
+
+    # 追加一批结果并落盘；翻译失败的条目写入失败报告，不进入结果文件
+    def append(self, results, failures=None):
+        if failures:
+            self._record_failures(failures)
+        if not results:
+            return
+        with self._lock:
+            if self._log is None:
+                self._log = open(self.log_file, 'a', encoding='utf-8')
+            count = 0
+            for source, translation in results.items():
+                # 重复出现的原文每行一条，压缩时按行号直接归并
+                for line in self._lines_of(source):
+                    self._log.write(json.dumps([line, source, translation], ensure_ascii=False) + '\n')
+                    count += 1
+            self._log.flush()
+            os.fsync(self._log.fileno())
+            self.log_count += count
+            self.new_count += len(results)
+            if self.log_count >= max(self.compact_every, self.compacted_count):
+                self._compact()
+
+    def _record_failures(self, failures):
+        with self._lock:
+            if self._failure_log is None:
+                self._failure_log = open(self.failure_file, 'w', encoding='utf-8-sig', newline='')
+                csv.writer(self._failure_log, lineterminator='\n').writerow(['原文', '错误'])
+            writer = csv.writer(self._failure_log, lineterminator='\n')
+            for source, error in failures.items():
+                writer.writerow([source, error])
+            self._failure_log.flush()
+            self.failure_count += len(failures)
+
+    # 把日志按行号排序成若干段：只有一段时留在内存中，多段时每段写入一个临时文件
+    def _sorted_log_runs(self):
+        def entries():
+            for line, source, translation in read_log_entries(self.log_file):
+                # 旧版日志没有行号，展开到原文所在的每一行
+                for position in self._lines_of(source) if line is None else [line]:
+                    yield position, source, translation
+        runs = []
+        for chunk in iter_chunks(entries(), self.compact_every):
+            chunk.sort(key=lambda entry: entry[0])
+            runs.append(chunk)
+            if len(runs) > 1:
+                runs = [self._spill_run(run, index) if isinstance(run, list) else run
+                        for index, run in enumerate(runs)]
+        return runs
+
+    def _spill_run(self, run, index):
+        path = f"{self.log_file}.run{index}"
+        with open(path, 'w', encoding='utf-8') as file:
+            for entry in run:
+                file.write(json.dumps(entry, ensure_ascii=False) + '\n')
+        return path
+
+    # 已有输出中的 (输入行号, 原文, 译文)：输出按输入顺序排列，重复原文的第 k 次出现对应它的第 k 个行号；
+    # 输入中已经没有的原文丢弃
+    def _output_entries(self):
+        seen = {}
+        for source, translation in read_output_rows(self.output_file, self.fmt):
+            lines = self._lines_of(source)
+            occurrence = 0
+            if len(lines) > 1:
+                occurrence = seen.get(source, 0)
+                seen[source] = occurrence + 1
+            if occurrence < len(lines):
+                yield lines[occurrence], source, translation
+
+    # 按行号归并日志各段和已有输出；同一行号只保留一条（日志在前，即较新的结果）。
+    # 在原子替换之后、删除日志之前崩溃时，日志条目已经在输出中，这里会去掉重复
+    def _merged_rows(self, runs):
+        sources = [iter(run) if isinstance(run, list) else read_log_run(run) for run in runs]
+        sources.append(self._output_entries())
+        last = None
+        for line, source, translation in heapq.merge(*sources, key=lambda entry: entry[0]):
+            if line == last:
+                continue
+            last = line
+            yield source, translation
+
+    # 把输出和日志归并为按输入顺序排列的新输出（调用方需持有锁）
+    def _compact(self):
+        if self._log is not None:
+            self._log.close()
+            self._log = None
+        runs = self._sorted_log_runs()
+        tmp_file = self.output_file + '.tmp'
+        try:
+            count = write_output_rows(tmp_file, self.fmt, self._merged_rows(runs))
+            os.replace(tmp_file, self.output_file)
+        except Exception as e:
+            print(f"保存翻译结果时出错: {str(e)}")
+            
+            # 尝试保存到备份文件，日志保留，下次运行时还能恢复
+            backup_file = f"backup_{self.output_file}"
+            try:
+                write_output_rows(backup_file, self.fmt, self._merged_rows(runs))
+                print(f"已保存备份文件: {backup_file}")
+            except:
+                print("无法保存备份文件，请检查磁盘空间和权限")
+            return False
+        finally:
+            for run in runs:
+                if not isinstance(run, list):
+                    os.remove(run)
         
-        # 去除换行符和空白行
-        words = [word.strip() for word in words if word.strip()]
-        print(f"从 {input_file} 读取了 {len(words)} 个单词")
+        # 新输出已落盘，日志可以删除；若在此之前崩溃，重放日志也是幂等的
+        if os.path.exists(self.log_file):
+            os.remove(self.log_file)
+        self.compacted_count = count
+        self.log_count = 0
+        return True
+
+    # 结束时做最后一次压缩
+    def close(self):
+        with self._lock:
+            if self._failure_log is not None:
+                self._failure_log.close()
+                self._failure_log = None
+                print(f"有 {self.failure_count} 个条目翻译失败，详见 {self.failure_file}，下次运行时会重试")
+            if self.log_count > 0 or os.path.exists(self.log_file):
+                return self._compact()
+            if self._log is not None:
+                self._log.close()
+                self._log = None
+            return True
+
+# 读取流式输出已提交的输入单词数，没有进度文件时为 0
+def stream_done_lines(output_file):
+    try:
+        with open(output_file + '.progress', 'r', encoding='utf-8') as file:
+            return json.load(file)['lines']
+    except (OSError, ValueError, KeyError):
+        return 0
+
+# 重排缓冲区：结果按完成顺序到达，按输入顺序取出已经连续完成的最长前缀。
+# 已取出的结果立即丢弃（同一个单词在后面还会出现时保留到最后一次），内存占用取决于乱序窗口而不是结果总数
+class ReorderBuffer:
+    def __init__(self, keys):
+        self.keys = keys
+        self.position = 0
+        self._last = {key: index for index, key in enumerate(keys)}
+        self._done = {}   # 已完成、尚未取出的 key -> (是否成功, 译文或错误)
+
+    def put(self, key, ok, value):
+        if key in self._last:
+            self._done[key] = (ok, value)
+
+    # 取出从当前位置开始已经连续完成的条目 [(key, 是否成功, 译文或错误)]；
+    # drain 为 True 时取出剩余的全部条目，没有结果的跳过
+    def pop_ready(self, drain=False):
+        ready = []
+        while self.position < len(self.keys):
+            key = self.keys[self.position]
+            item = self._done.get(key)
+            if item is not None:
+                ready.append((key, *item))
+                if self._last[key] == self.position:
+                    del self._done[key]
+            elif not drain:
+                break
+            self.position += 1
+        return ready
+
+# 流式模式的结果写入器：每块开始时用 begin 登记这块的单词，结果到达后经重排缓冲区按输入顺序立即追加到输出
+# （不等整块完成，下游可以用 tail -f 跟着读取），块完成后落盘，再原子更新进度文件
+# （<输出文件>.progress，记录已提交的输入单词数和输出文件长度）。续跑时把输出截断到上次提交时的长度，
+# 跳过已提交的输入，因此不需要在内存中保存全部单词或已完成集合。parquet 格式每块写一个分片，仍在块完成时写出
+class StreamResultWriter:
+    def __init__(self, output_file, fmt='csv'):
+        self.output_file = output_file
+        self.fmt = fmt
+        self.progress_file = output_file + '.progress'
+        self.failure_file = output_file + '.failures.csv'
+        self.done_lines = 0
+        self.failure_count = 0
+        self.new_count = 0
+        self.total_rows = 0      # 累计写出的结果行数（含之前的运行）
+        self.total_failed = 0    # 累计失败的条目数（含之前的运行）
+        self._buffer = None
+        self._rows = []          # 本块中尚未写出的行（parquet 格式在块完成时一起写出）
+        self._chunk_rows = 0
+        self._failures = {}
+        self._lock = threading.Lock()
+
+    # 读取续跑进度，丢弃上次提交之后写出的半块结果
+    def load_progress(self):
+        if not os.path.exists(self.progress_file):
+            if os.path.exists(self.output_file):
+                raise ValueError("输出文件不是流式模式生成的（没有进度文件），请先移走该文件或去掉 --stream")
+            # 第一块提交前就会写出结果，先记下空进度，中断后续跑时才能认出并丢弃这些行
+            self._save_progress(0, 0)
+            return
+        with open(self.progress_file, 'r', encoding='utf-8') as file:
+            progress = json.load(file)
+        self.done_lines = progress['lines']
+        self.total_rows = progress.get('rows', 0)
+        self.total_failed = progress.get('failed', 0)
+        truncate_output(self.output_file, self.fmt, progress['size'])
+        truncate_output(self.failure_file, 'csv', progress['failure_size'])
+
+    # 开始一块：登记这块要按顺序输出的单词
+    def begin(self, words):
+        with self._lock:
+            self._buffer = ReorderBuffer(words)
+            self._rows = []
+            self._chunk_rows = 0
+            self._failures = {}
+
+    # 把重排缓冲区中已经连续完成的行写出（调用方需持有锁）
+    def _emit(self, drain=False):
+        self._rows += [(word, value) for word, ok, value in self._buffer.pop_ready(drain) if ok]
+        if self._rows and self.fmt != 'parquet':
+            append_output_rows(self.output_file, self.fmt, self._rows, sync=False)
+            self._chunk_rows += len(self._rows)
+            self._rows = []
+
+    def append(self, results, failures=None):
+        with self._lock:
+            for word, translation in results.items():
+                self._buffer.put(word, True, translation)
+            for word, error in (failures or {}).items():
+                self._buffer.put(word, False, error)
+                self._failures[word] = error
+            self.new_count += len(results)
+            self._emit()
+
+    # 追加失败条目并落盘，返回失败报告的长度；文件不存在时先写表头
+    def _append_failures(self, rows):
+        if not rows:
+            return os.path.getsize(self.failure_file) if os.path.exists(self.failure_file) else 0
+        with open(self.failure_file, 'a', encoding='utf-8-sig', newline='') as file:
+            writer = csv.writer(file, lineterminator='\n')
+            if file.tell() == 0:
+                writer.writerow(['原文', '错误'])
+            writer.writerows(rows)
+            file.flush()
+            os.fsync(file.fileno())
+            return os.fstat(file.fileno()).st_size
+
+    # 原子更新进度文件
+    def _save_progress(self, size, failure_size):
+        temp_file = self.progress_file + '.tmp'
+        with open(temp_file, 'w', encoding='utf-8') as file:
+            json.dump({'lines': self.done_lines, 'size': size, 'failure_size': failure_size,
+                       'rows': self.total_rows, 'failed': self.total_failed}, file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_file, self.progress_file)
+
+    # 提交一块：写出这块剩余的结果（没有结果的单词跳过），把输出和失败条目落盘，然后更新进度
+    def commit(self, words):
+        with self._lock:
+            self._emit(drain=True)
+            rows = self._rows
+            size = append_output_rows(self.output_file, self.fmt, rows)
+            failed = [word for word in dict.fromkeys(words) if word in self._failures]
+            failure_size = self._append_failures([(word, self._failures[word]) for word in failed])
+            self.failure_count += len(failed)
+            self.total_rows += self._chunk_rows + len(rows)
+            self.total_failed += len(failed)
+            self.done_lines += len(words)
+            self._save_progress(size, failure_size)
+            self._buffer = None
+            self._rows = []
+            self._chunk_rows = 0
+            self._failures = {}
+
+    def close(self):
+        if self.failure_count:
+            print(f"有 {self.failure_count} 个条目翻译失败，详见 {self.failure_file}；流式模式不会自动重试，"
+                  f"可以用 --column 原文 把失败报告作为输入重新翻译")
+        if self.done_lines:
+            print(f"翻译结果已保存为 {self.output_file}")
+        return True
+
+# 支持的规范化规则
+NORMALIZE_RULES = ('space', 'case', 'paren')
+
+# 解析 --normalize 参数
+def parse_normalize_rules(value):
+    rules = set()
+    for rule in value.split(','):
+        rule = rule.strip().lower()
+        if not rule or rule == 'none':
+            continue
+        if rule not in NORMALIZE_RULES:
+            raise ValueError(f"未知的规范化规则: {rule}，可选: {', '.join(NORMALIZE_RULES)}")
+        rules.add(rule)
+    return rules
+
+# 匹配 "术语 (全称)" 形式的条目，兼容中文括号
+_paren_pattern = re.compile(r'^(.+?)\s*[(（]([^()（）]+)[)）]$')
+
+# 把一行输入拆成待翻译的单元
+def split_entry(word, rules):
+    text = ' '.join(word.split()) if 'space' in rules else word
+    if 'paren' in rules:
+        match = _paren_pattern.match(text)
+        if match:
+            return [match.group(1), match.group(2).strip()]
+    return [text]
+
+# 单元的去重键
+def canonical_key(unit, rules):
+    return unit.casefold() if 'case' in rules else unit
+
+# 多模式字符串匹配（Aho-Corasick 自动机）：一次扫描文本即可找出所有术语，耗时与术语表大小无关
+class TermMatcher:
+    def __init__(self):
+        self.goto = [{}]   # 节点 -> {字符: 子节点}
+        self.fail = [0]    # 失配时跳转的节点
+        self.link = [-1]   # 沿失配链最近的术语结尾节点，-1 表示没有
+        self.end = {}      # 术语结尾节点 -> 术语
+        self._built = True
+
+    def add(self, term):
+        node = 0
+        for ch in term:
+            child = self.goto[node].get(ch)
+            if child is None:
+                child = len(self.goto)
+                self.goto.append({})
+                self.fail.append(0)
+                self.link.append(-1)
+                self.goto[node][ch] = child
+            node = child
+        self.end[node] = term
+        self._built = False
+
+    # 按广度优先计算失配链接
+    def build(self):
+        pending = collections.deque(self.goto[0].values())
+        while pending:
+            node = pending.popleft()
+            for ch, child in self.goto[node].items():
+                pending.append(child)
+                state = self.fail[node]
+                while state and ch not in self.goto[state]:
+                    state = self.fail[state]
+                target = self.goto[state].get(ch, 0)
+                self.fail[child] = target if target != child else 0
+                self.link[child] = self.fail[child] if self.fail[child] in self.end else self.link[self.fail[child]]
+        self._built = True
+
+    # 返回文本中所有术语出现的位置 (起点, 终点, 术语)，可能重叠
+    def find(self, text):
+        if not self._built:
+            self.build()
+        matches = []
+        node = 0
+        for index, ch in enumerate(text):
+            while node and ch not in self.goto[node]:
+                node = self.fail[node]
+            node = self.goto[node].get(ch, 0)
+            hit = node if node in self.end else self.link[node]
+            while hit > 0:
+                term = self.end[hit]
+                matches.append((index + 1 - len(term), index + 1, term))
+                hit = self.link[hit]
+        return matches
+
+# 术语占位符：保护的术语在送进模型前替换为 [0]、[1]……，翻译后再换回
+_placeholder_pattern = re.compile(r'\[\s*(\d+)\s*\]')
+# 全大写的缩写（CPU、BIOS、ES6、APIs），--keep_acronyms 时原样保留
+_acronym_pattern = re.compile(r'\b[A-Z][A-Z0-9]+s?\b')
+
+# 术语表：术语 -> 固定译文（保持原样的术语译文就是它本身），区分大小写，只匹配完整的词
+class Glossary:
+    def __init__(self, keep_acronyms=False):
+        self.terms = {}
+        self.matcher = TermMatcher()
+        self.keep_acronyms = keep_acronyms
+
+    def __len__(self):
+        return len(self.terms)
+
+    def add(self, term, translation=None):
+        term = term.strip()
+        if term:
+            self.terms[term] = translation.strip() if translation and translation.strip() else term
+            self.matcher.add(term)
+
+    # 找出单元中要保护的术语，返回 (带占位符的文本, 各占位符对应的译文)；没有术语时返回 (None, None)
+    # 术语表中的术语优先，同一位置取最长的匹配，互不重叠
+    def protect(self, text):
+        if _placeholder_pattern.search(text):
+            # 原文本身含有 [数字]，无法区分占位符
+            return None, None
+        candidates = [(start, end, self.terms[term]) for start, end, term in self.matcher.find(text)
+                      if is_word_boundary(text, start, end)]
+        candidates.sort(key=lambda item: (item[0], -(item[1] - item[0])))
+        if self.keep_acronyms:
+            candidates += [(match.start(), match.end(), match.group()) for match in _acronym_pattern.finditer(text)]
+        chosen = []
+        for start, end, replacement in candidates:
+            if all(end <= other[0] or start >= other[1] for other in chosen):
+                chosen.append((start, end, replacement))
+        if not chosen:
+            return None, None
+        chosen.sort()
+        parts = []
+        position = 0
+        for index, (start, end, _) in enumerate(chosen):
+            parts.append(text[position:start])
+            parts.append(f"[{index}]")
+            position = end
+        parts.append(text[position:])
+        return ''.join(parts), [replacement for _, _, replacement in chosen]
+
+# 术语的边界不能落在单词中间（"CPU" 不匹配 "CPUs" 以外的 "XCPU"）
+def is_word_boundary(text, start, end):
+    def word_char(ch):
+        return ch.isalnum() or ch == '_'
+    if start > 0 and word_char(text[start]) and word_char(text[start - 1]):
+        return False
+    if end < len(text) and word_char(text[end - 1]) and word_char(text[end]):
+        return False
+    return True
+
+# 把译文中的占位符换回术语；占位符缺失、重复或多出时返回 None
+def restore_placeholders(translation, replacements):
+    found = sorted(int(match) for match in _placeholder_pattern.findall(translation))
+    if found != list(range(len(replacements))):
+        return None
+    return _placeholder_pattern.sub(lambda match: replacements[int(match.group(1))], translation)
+
+# 读取术语表文件（逗号分隔多个）：.csv 为双语表（前两列为 原文,译文，可以直接用本脚本的输出，表头自动跳过，
+# 只有一列时保持原样）；其他文件每行一个术语，"术语<Tab>译文" 表示固定译文，只有术语表示保持原样，# 开头的行为注释
+def load_glossary(paths, keep_acronyms=False):
+    glossary = Glossary(keep_acronyms)
+    for path in [item.strip() for item in (paths or '').split(',') if item.strip()]:
+        with open(path, 'r', encoding='utf-8-sig', newline='') as file:
+            if path.lower().endswith('.csv'):
+                for row in csv.reader(file):
+                    if not row or row[0].strip().lower() in ('原文', 'source', 'term'):
+                        continue
+                    glossary.add(row[0], row[1] if len(row) > 1 else None)
+            else:
+                for line in file:
+                    if not line.strip() or line.lstrip().startswith('#'):
+                        continue
+                    term, _, translation = line.rstrip('\r\n').partition('\t')
+                    glossary.add(term, translation)
+    return glossary
+
+# 规范化去重索引：把输入行拆成单元并算出去重键，与目标语言无关，
+# 多个目标语言时每个输入文件（流式模式下每块）只建一次，各语言的 TranslationPlan 共用
+class DedupeIndex:
+    def __init__(self, words, rules):
+        self.rules = rules
+        self.units = {}    # 去重键 -> 代表文本（第一次出现的写法）
+        self.entries = {}  # 原始行 -> 依赖的去重键列表
+        for word in words:
+            if word in self.entries:
+                continue
+            keys = []
+            for unit in split_entry(word, rules):
+                key = canonical_key(unit, rules)
+                self.units.setdefault(key, unit)
+                keys.append(key)
+            self.entries[word] = keys
+
+# 规范化去重计划：把输入行拆成单元并去重，每个唯一单元只翻译一次，
+# 某一行依赖的单元全部翻译完成后，组装出这一行的译文交给 writer（扇出回每一行）
+# index 为共用的 DedupeIndex（须包含 words 中的所有行），不指定时按 words 新建
+class TranslationPlan:
+    def __init__(self, words, rules, writer, index=None):
+        if index is None:
+            index = DedupeIndex(words, rules)
+        self.rules = rules
+        self.writer = writer
+        self.units = {}       # 去重键 -> 代表文本（第一次出现的写法）
+        self.entries = {}     # 原始行 -> 依赖的去重键列表
+        self.dependents = {}  # 去重键 -> 依赖它的原始行
+        self.missing = {}     # 原始行 -> 尚未完成的单元数
+        self.done_units = {}  # 已完成的去重键 -> 译文
+        self._lock = threading.Lock()
+        for word in words:
+            if word in self.entries:
+                continue
+            keys = index.entries[word]
+            for key in dict.fromkeys(keys):
+                self.units.setdefault(key, index.units[key])
+                self.dependents.setdefault(key, []).append(word)
+            self.entries[word] = keys
+            self.missing[word] = len(set(keys))
+
+    # 已写出的行数，用于统计速度
+    @property
+    def new_count(self):
+        return self.writer.new_count
+
+    # 需要交给模型翻译的唯一单元
+    def unit_texts(self):
+        return list(self.units.values())
+
+    # 组装一行的译文：带全称的条目还原为 "术语译文 (全称译文)"
+    def _assemble(self, word):
+        parts = [self.done_units[key] for key in self.entries[word]]
+        if len(parts) == 2:
+            return f"{parts[0]} ({parts[1]})"
+        return parts[0]
+
+    # 接收一批单元的译文，把已经完整的行交给 writer；失败的单元按依赖它的行报告
+    def append(self, unit_results, unit_failures=None):
+        completed = {}
+        failed = {}
+        with self._lock:
+            for unit, error in (unit_failures or {}).items():
+                for word in self.dependents.pop(canonical_key(unit, self.rules), []):
+                    self.missing.pop(word, None)
+                    failed[word] = error
+            for unit, translation in unit_results.items():
+                key = canonical_key(unit, self.rules)
+                if key in self.done_units or key not in self.dependents:
+                    continue
+                self.done_units[key] = translation
+                for word in self.dependents.pop(key):
+                    if word not in self.missing:  # 该行的其他单元已失败
+                        continue
+                    self.missing[word] -= 1
+                    if self.missing[word] == 0:
+                        del self.missing[word]
+                        completed[word] = self._assemble(word)
+        self.writer.append(completed, failed)
+
+# 多线程翻译函数：在线程池中翻译一批
+def translate_worker(batch, from_lang, to_lang, cache=None, backend='argos', retries=3, retry_delay=0.5):
+    return translate_words(batch, from_lang, to_lang, cache, backend, retries, retry_delay)
+
+# 进程池翻译函数
+def translate_batch(batch, from_lang, to_lang, cache=None, backend='argos', retries=3, retry_delay=0.5):
+    return translate_words(batch, from_lang, to_lang, cache, backend, retries, retry_delay)
+
+# 进程池和线程池共用的任务元组，最后一项是提交时间
+def batch_task(batch, args, cache):
+    return (batch, args.from_lang, args.to_lang, cache, args.backend, args.retries, args.retry_delay, time.time())
+
+# imap_unordered 只接受单个参数，这里把参数元组展开
+def translate_batch_task(task):
+    return translate_batch(*task)
+
+# 带性能明细的翻译任务，进程池和线程池共用：task 的最后一项是提交时间（time.time()，跨进程可比），
+# 返回 (译文字典, 失败字典, trace)
+def translate_batch_traced(task):
+    *batch_args, submitted_at = task
+    trace = begin_trace()
+    trace['stages']['queue_wait'] = max(0.0, time.time() - submitted_at)
+    start = time.perf_counter()
+    try:
+        results, failures = translate_batch(*batch_args)
+    finally:
+        end_trace()
+    trace['total'] = time.perf_counter() - start
+    trace['pid'] = os.getpid()
+    trace['rss_mb'] = current_rss_mb()
+    trace['batch_size'] = len(batch_args[0])
+    return results, failures, trace
+
+# 把一批结果交给 writer，并记录写出耗时和这一批的性能明细
+def deliver_batch(writer, args, results, failures, trace):
+    start = time.perf_counter()
+    writer.append(results, failures)
+    metrics = getattr(args, 'metrics', None)
+    if metrics is not None:
+        trace['stages']['write'] = time.perf_counter() - start
+        metrics.record(trace, args.from_lang, args.to_lang)
+
+# 在进程池中执行所有批次：哪一批先完成就先把结果交给 writer，没有轮询
+def run_pool_batches(pool, batches, args, cache, writer, progress=True):
+    tasks = (batch_task(batch, args, cache) for batch in batches)
+    from tqdm import tqdm
+    with tqdm(total=len(batches), desc="批次进度", disable=not progress) as pbar:
+        for results, failures, trace in pool.imap_unordered(translate_batch_traced, tasks):
+            deliver_batch(writer, args, results, failures, trace)
+            pbar.update(1)
+
+# 在线程池中执行所有批次：按完成顺序收集结果，没有轮询
+def run_thread_batches(batches, args, cache, writer, progress=True):
+    executor = ThreadPoolExecutor(max_workers=min(args.threads, len(batches)))
+    try:
+        futures = [
+            executor.submit(translate_batch_traced, batch_task(batch, args, cache))
+            for batch in batches
+        ]
+        from tqdm import tqdm
+        with tqdm(total=len(batches), desc="批次进度", disable=not progress) as pbar:
+            for future in as_completed(futures):
+                try:
+                    deliver_batch(writer, args, *future.result())
+                except Exception as e:
+                    print(f"线程处理时出错: {str(e)}")
+                pbar.update(1)
+    finally:
+        # 中断时取消尚未开始的批次，不等待它们执行完
+        executor.shutdown(wait=False, cancel_futures=True)
+
+# 异步模式：带重试的单次批量调用，只重试与内容无关的临时错误（网络错误、超时、服务繁忙），
+# 退避时间为指数增长上限内的随机值（full jitter），避免大量请求同时重试
+async def call_with_retry(translator, segments, limiter, retries, base_delay):
+    for attempt in range(retries + 1):
+        try:
+            start = time.perf_counter()
+            async with limiter:
+                # 等待后端并发名额的时间计入 queue_wait
+                add_stage('queue_wait', time.perf_counter() - start)
+                add_count('model_calls')
+                before = trace_stage_total(MODEL_STAGES)
+                start = time.perf_counter()
+                try:
+                    return await translator.translate_segments_async(segments)
+                finally:
+                    if trace_stage_total(MODEL_STAGES) == before:
+                        add_stage('inference', time.perf_counter() - start)
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, TransientTranslationError) as e:
+            if attempt == retries:
+                raise
+            add_count('retries')
+            delay = random.uniform(0, base_delay * (2 ** attempt))
+            print(f"批量翻译临时出错: {str(e)}，{delay:.2f} 秒后重试")
+            await asyncio.sleep(delay)
+
+# 异步版本的二分定位失败条目
+async def translate_with_bisect_async(segments, translator, limiter, args, translated, failures):
+    try:
+        outputs = await call_with_retry(translator, segments, limiter, args.retries, args.retry_delay)
     except Exception as e:
-        print(f"读取输入文件时出错: {str(e)}")
-        sys.exit(1)
+        if len(segments) == 1:
+            print(f"翻译 '{segments[0]}' 时出错: {str(e)}")
+            failures[segments[0]] = str(e)
+            add_count('failed_items')
+            return
+        add_count('bisect_splits')
+        mid = len(segments) // 2
+        await asyncio.gather(
+            translate_with_bisect_async(segments[:mid], translator, limiter, args, translated, failures),
+            translate_with_bisect_async(segments[mid:], translator, limiter, args, translated, failures),
+        )
+        return
+    for segment, output in zip(segments, outputs):
+        translated[segment] = output
+
+# 异步版本的 translate_words：缓存读写放到线程中执行，不阻塞事件循环
+# translator 为 None 时（模型加载失败）与同步模式相同：缓存命中的条目照常返回，其余条目报告为失败（错误信息为 load_error）
+async def translate_words_async(batch, translator, limiter, args, cache=None, load_error=None):
+    start = time.perf_counter()
+    result = await asyncio.to_thread(cache.get_many, batch) if cache is not None else {}
+    add_stage('cache_read', time.perf_counter() - start)
+    add_count('segments', len(batch))
+    add_count('cache_hits', len(result))
+    failures = {}
+    pending = [word for word in batch if word not in result]
+    if not pending:
+        return result, failures
+    if translator is None:
+        return result, {word: load_error for word in pending}
     
-    # 检查是否存在已翻译的结果文件
-    existing_translations = {}
-    if os.path.exists(output_file):
+    translated = {}
+    await translate_with_bisect_async(pending, translator, limiter, args, translated, failures)
+    if cache is not None:
+        start = time.perf_counter()
         try:
-            # 读取已翻译的结果
-            df_existing = pd.read_csv(output_file)
-            existing_translations = dict(zip(df_existing['原文'], df_existing['翻译']))
-            print(f"从 {output_file} 读取了 {len(existing_translations)} 个已翻译的单词")
-        except Exception as e:
-            print(f"读取已有翻译文件时出错: {str(e)}")
-            print("将创建新的翻译文件")
+            await asyncio.to_thread(cache.put_many, translated)
+        except sqlite3.Error as e:
+            print(f"写入翻译缓存时出错: {str(e)}")
+        add_stage('cache_write', time.perf_counter() - start)
+    result.update(translated)
+    return result, failures
+
+# 带性能明细的异步翻译任务：每个 asyncio 任务有自己的上下文，trace 互不干扰
+async def translate_words_async_traced(batch, translator, limiter, args, cache=None, load_error=None):
+    trace = begin_trace()
+    start = time.perf_counter()
+    results, failures = await translate_words_async(batch, translator, limiter, args, cache, load_error)
+    trace['total'] = time.perf_counter() - start
+    trace['pid'] = os.getpid()
+    trace['batch_size'] = len(batch)
+    return results, failures, trace
+
+# 在事件循环中执行所有批次：最多 --max_in_flight 个批次同时在途，后端自身的并发上限另由信号量控制；
+# 结果按批次提交顺序收集，队首批次完成后才补充新批次，在途窗口和内存都有上界
+async def run_async_batches(batches, args, cache, writer):
+    load_error = None
+    try:
+        translator = get_translator(args.from_lang, args.to_lang, args.backend)
+    except Exception as e:
+        print(f"加载翻译模型时出错: {str(e)}")
+        translator = None
+        load_error = str(e)
+    limiter = asyncio.Semaphore(getattr(translator, 'max_concurrency', None) or args.threads)
+    window = collections.deque()
+    batch_iter = iter(batches)
+    
+    def fill_window():
+        while len(window) < args.max_in_flight:
+            batch = next(batch_iter, None)
+            if batch is None:
+                return
+            window.append(asyncio.ensure_future(translate_words_async_traced(batch, translator, limiter, args, cache, load_error)))
+    
+    try:
+        from tqdm import tqdm
+        with tqdm(total=len(batches), desc="批次进度") as pbar:
+            fill_window()
+            while window:
+                results, failures, trace = await window.popleft()
+                await asyncio.to_thread(deliver_batch, writer, args, results, failures, trace)
+                pbar.update(1)
+                fill_window()
+    finally:
+        # 中断时取消尚在途的批次
+        for task in window:
+            task.cancel()
+        if translator is not None:
+            translator.close()
+
+# 性能指标汇总：按阶段统计每批耗时的直方图和事件计数；每批的明细追加到 JSONL 文件，
+# 汇总每隔 interval 秒原子地重写一次 Prometheus 文本文件（可交给 node_exporter 的 textfile collector 采集）
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+class MetricsRecorder:
+    def __init__(self, trace_file=None, prometheus_file=None, interval=10.0):
+        self.prometheus_file = prometheus_file
+        self.interval = interval
+        self.buckets = {stage: [0] * len(LATENCY_BUCKETS) for stage in METRIC_STAGES + ('total',)}
+        self.sums = {stage: 0.0 for stage in self.buckets}
+        self.counts = {stage: 0 for stage in self.buckets}
+        self.counters = collections.Counter()
+        self.batches = 0
+        self.worker_rss = {}
+        self._trace_log = open(trace_file, 'a', encoding='utf-8') if trace_file else None
+        self._last_export = time.time()
+        self._lock = threading.Lock()
+
+    def _observe(self, stage, seconds):
+        self.sums[stage] += seconds
+        self.counts[stage] += 1
+        for index, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                self.buckets[stage][index] += 1
+
+    # 记录一批的明细（主进程中调用）
+    def record(self, trace, from_lang, to_lang):
+        with self._lock:
+            self.batches += 1
+            for stage, seconds in trace['stages'].items():
+                self._observe(stage, seconds)
+            if 'total' in trace:
+                self._observe('total', trace['total'])
+            self.counters.update(trace['counters'])
+            if trace.get('rss_mb') is not None:
+                self.worker_rss[trace.get('pid')] = max(trace['rss_mb'], self.worker_rss.get(trace.get('pid'), 0.0))
+            if self._trace_log is not None:
+                self._trace_log.write(json.dumps({
+                    'time': round(time.time(), 3),
+                    'from_lang': from_lang,
+                    'to_lang': to_lang,
+                    'pid': trace.get('pid'),
+                    'batch_size': trace.get('batch_size'),
+                    'rss_mb': round(trace['rss_mb'], 1) if trace.get('rss_mb') is not None else None,
+                    'total': round(trace.get('total', 0.0), 6),
+                    'stages': {stage: round(seconds, 6) for stage, seconds in trace['stages'].items()},
+                    'counters': trace['counters'],
+                }, ensure_ascii=False) + '\n')
+            if self.prometheus_file and time.time() - self._last_export >= self.interval:
+                self._export()
+
+    # 重写 Prometheus 文本文件（调用方需持有锁）
+    def _export(self):
+        self._last_export = time.time()
+        lines = [
+            '# HELP batch_translate_stage_seconds Per-batch time spent in each pipeline stage.',
+            '# TYPE batch_translate_stage_seconds histogram',
+        ]
+        for stage in self.buckets:
+            if not self.counts[stage]:
+                continue
+            for bound, count in zip(LATENCY_BUCKETS, self.buckets[stage]):
+                lines.append(f'batch_translate_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {count}')
+            lines.append(f'batch_translate_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {self.counts[stage]}')
+            lines.append(f'batch_translate_stage_seconds_sum{{stage="{stage}"}} {self.sums[stage]:.6f}')
+            lines.append(f'batch_translate_stage_seconds_count{{stage="{stage}"}} {self.counts[stage]}')
+        lines.append('# HELP batch_translate_batches_total Batches completed.')
+        lines.append('# TYPE batch_translate_batches_total counter')
+        lines.append(f'batch_translate_batches_total {self.batches}')
+        lines.append('# HELP batch_translate_events_total Segments, cache hits, model calls, bisect splits, mismatches, retries and failed items.')
+        lines.append('# TYPE batch_translate_events_total counter')
+        for name, value in sorted(self.counters.items()):
+            lines.append(f'batch_translate_events_total{{event="{name}"}} {value}')
+        if self.worker_rss:
+            # 工作进程会被回收替换，按 pid 分别导出会让序列数不断增长，这里只导出最大值
+            lines.append('# HELP batch_translate_worker_peak_rss_bytes Highest resident memory reported by any worker after a batch.')
+            lines.append('# TYPE batch_translate_worker_peak_rss_bytes gauge')
+            lines.append(f'batch_translate_worker_peak_rss_bytes {int(max(self.worker_rss.values()) * 1024 * 1024)}')
+        temp_file = self.prometheus_file + '.tmp'
+        try:
+            with open(temp_file, 'w', encoding='utf-8') as file:
+                file.write('\n'.join(lines) + '\n')
+            os.replace(temp_file, self.prometheus_file)
+        except OSError as e:
+            print(f"写入指标文件时出错: {str(e)}")
+
+    # 打印各阶段的耗时占比，看时间花在模型、二分重试还是 I/O 上
+    def summary(self):
+        busy = sum(self.sums[stage] for stage in METRIC_STAGES)
+        if not self.batches or busy <= 0:
+            return
+        parts = [f"{stage} {self.sums[stage] / busy * 100:.1f}%" for stage in METRIC_STAGES if self.sums[stage] > 0]
+        print(f"阶段耗时占比（共 {self.batches} 批）：" + '，'.join(parts))
+        events = ['model_calls', 'bisect_splits', 'mismatches', 'retries', 'failed_items', 'cache_hits']
+        print("事件计数：" + '，'.join(f"{name} {self.counters.get(name, 0)}" for name in events))
+        if self.worker_rss:
+            print(f"工作进程峰值内存：最高 {max(self.worker_rss.values()):.0f} MB（共 {len(self.worker_rss)} 个进程）")
+
+    def close(self):
+        with self._lock:
+            if self.prometheus_file:
+                self._export()
+            if self._trace_log is not None:
+                self._trace_log.close()
+                self._trace_log = None
+        self.summary()
+
+# 自动调优时丢弃结果、只计数的结果接收者
+class CountingSink:
+    def __init__(self):
+        self.count = 0
+
+    def append(self, results, failures=None):
+        self.count += len(results) + len(failures or {})
+
+# 用样本试跑一种配置，返回 词/秒（不含进程池创建和模型预热时间，不读写缓存）
+def measure_config(sample, args, threads, batch_size, use_mp):
+    trial = argparse.Namespace(**vars(args))
+    trial.threads = threads
+    batches = make_batches(sample, args.token_budget, batch_size)
+    sink = CountingSink()
+    if use_mp:
+        # 新启动的工作进程按本次试跑的进程数分配线程
+        if args.in_process_backend:
+            apply_thread_budget(plan_thread_budget(args.device_type, threads, True))
+        # 多线程试跑留下的模型不能被 fork 出的工作进程继承（CTranslate2 模型在 fork 之后不可用，
+        # 线程预算也是多线程试跑的），先释放，工作进程各自按本次的预算创建
+        release_translators()
+        with create_worker_pool(threads, args.from_lang, args.to_lang, args.backend) as pool:
+            start = time.perf_counter()
+            run_pool_batches(pool, batches, trial, None, sink, progress=False)
+            elapsed = time.perf_counter() - start
+    else:
+        if args.in_process_backend:
+            # 多线程共享一个模型，它的 inter/intra 线程数在创建时确定：按本次试跑的线程数重新分配并重新创建
+            apply_thread_budget(plan_thread_budget(args.device_type, threads, False))
+            release_translators()
+        get_translator(args.from_lang, args.to_lang, args.backend).warm_up()
+        start = time.perf_counter()
+        run_thread_batches(batches, trial, None, sink, progress=False)
+        elapsed = time.perf_counter() - start
+    return sink.count / elapsed if elapsed > 0 else 0.0
+
+# 从输入中等间隔抽取样本，保证样本覆盖长短不同的条目
+def sample_words(words, size):
+    words = list(dict.fromkeys(words))
+    if len(words) <= size:
+        return words
+    step = len(words) / size
+    return [words[int(i * step)] for i in range(size)]
+
+# 配置档案中区分机器和任务的键
+def profile_key(args):
+    return f"{platform.node()}|cpus={os.cpu_count()}|{backend_identity(args.backend)}|{args.from_lang}->{args.to_lang}"
+
+def load_profile(path, key):
+    try:
+        with open(path, 'r', encoding='utf-8') as file:
+            return json.load(file).get(key)
+    except (OSError, ValueError):
+        return None
+
+def save_profile(path, key, profile):
+    profiles = {}
+    try:
+        with open(path, 'r', encoding='utf-8') as file:
+            profiles = json.load(file)
+    except (OSError, ValueError):
+        pass
+    profiles[key] = profile
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    tmp_file = path + '.tmp'
+    with open(tmp_file, 'w', encoding='utf-8') as file:
+        json.dump(profiles, file, ensure_ascii=False, indent=2)
+    os.replace(tmp_file, path)
+
+# 自动调优：逐个维度试跑候选配置（先每批单词数，再线程数，最后比较线程和进程模式），
+# 每一步固定其他维度取当前最优，试跑次数只与 CPU 核数的对数成正比
+def auto_tune(words, args):
+    cpu_count = os.cpu_count() or 1
+    sample = sample_words(words, args.auto_sample)
+    if not sample:
+        return None
+    print(f"自动调优：使用 {len(sample)} 个样本单词试跑候选配置...")
+    trials = []
+
+    def trial(threads, batch_size, use_mp):
+        speed = measure_config(sample, args, threads, batch_size, use_mp)
+        mode = '多进程' if use_mp else '多线程'
+        print(f"  {mode} 数量={threads} 每批={batch_size}: {speed:.2f} 词/秒")
+        trials.append({'threads': threads, 'batch_size': batch_size, 'use_mp': use_mp, 'words_per_sec': round(speed, 2)})
+        return speed
+
+    # 第一步：固定线程数，选每批单词数
+    threads = min(4, cpu_count)
+    best_batch = max([8, 16, 32, 64], key=lambda batch_size: trial(threads, batch_size, False))
+    
+    # 第二步：固定每批单词数，按 2 的幂选线程数
+    candidates = sorted({min(2 ** i, cpu_count) for i in range(cpu_count.bit_length() + 1)})
+    best_threads = max(candidates, key=lambda n: trial(n, best_batch, False))
+    
+    # 第三步：同样的配置换成多进程模式比较
+    trial(best_threads, best_batch, True)
+    
+    best = dict(max(trials, key=lambda t: t['words_per_sec']))
+    best['calibrated_at'] = time.strftime('%Y-%m-%dT%H:%M:%S')
+    best['trials'] = trials
+    return best
+
+# 解析逗号分隔的目标语言列表，去掉重复项并保持顺序
+def parse_target_langs(value):
+    langs = []
+    for lang in value.split(','):
+        lang = lang.strip()
+        if lang and lang not in langs:
+            langs.append(lang)
+    if not langs:
+        raise ValueError("至少需要一个目标语言")
+    return langs
+
+# 某个目标语言使用的参数副本：流水线中的其他函数都只看 args.to_lang
+def target_args(args, to_lang):
+    return argparse.Namespace(**{**vars(args), 'to_lang': to_lang})
+
+# 逐条读取输入中的单词（生成器，不把整个文件读入内存），按扩展名选择格式：
+# .gz 先解压，再按去掉 .gz 后的扩展名处理；.csv/.tsv 取 column 指定的列（第一行为表头，column 为列名或
+# 从 0 开始的序号，默认第一列）；.jsonl/.ndjson 取 column 指定的字段（默认 text），无法解析的行跳过；
+# 其他文件按纯文本处理，每行一个单词。空白条目都会跳过
+def iter_input_words(path, column=None):
+    name = path.lower()
+    if name.endswith('.gz'):
+        opener = gzip.open
+        name = name[:-3]
+    else:
+        opener = open
+    with opener(path, 'rt', encoding='utf-8-sig', newline='') as file:
+        if name.endswith(('.csv', '.tsv')):
+            reader = csv.reader(file, delimiter='\t' if name.endswith('.tsv') else ',')
+            header = next(reader, None)
+            if header is None:
+                return
+            if column is None:
+                index = 0
+            elif column in header:
+                index = header.index(column)
+            elif column.isdigit():
+                index = int(column)
+            else:
+                raise ValueError(f"{path} 中没有名为 {column} 的列")
+            for row in reader:
+                if index < len(row) and row[index].strip():
+                    yield row[index].strip()
+        elif name.endswith(('.jsonl', '.ndjson')):
+            field = column or 'text'
+            for line in file:
+                try:
+                    value = json.loads(line).get(field)
+                except (ValueError, AttributeError):
+                    continue
+                if isinstance(value, str) and value.strip():
+                    yield value.strip()
+        else:
+            for line in file:
+                if line.strip():
+                    yield line.strip()
+
+# 把单词流切成最多 size 个单词的块
+def iter_chunks(words, size):
+    words = iter(words)
+    while True:
+        chunk = list(itertools.islice(words, size))
+        if not chunk:
+            return
+        yield chunk
+
+# 输出文件名使用的输入文件名（去掉 .gz 和扩展名）
+def input_stem(input_file):
+    path = Path(input_file)
+    if path.suffix.lower() == '.gz':
+        path = Path(path.stem)
+    return path.stem
+
+# 解析 --shard i/N（i 从 0 开始），返回 (i, N)
+def parse_shard(value):
+    match = re.fullmatch(r'\s*(\d+)\s*/\s*(\d+)\s*', value)
+    if not match or not 0 <= int(match.group(1)) < int(match.group(2)):
+        raise ValueError(f"分片格式应为 i/N 且 0 <= i < N: {value}")
+    return int(match.group(1)), int(match.group(2))
+
+# 稳定的分片哈希：只取决于条目文本，与机器、进程和 Python 的哈希随机化无关，各分片互不重叠
+def shard_of(word, shard_count):
+    digest = hashlib.blake2b(word.encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big') % shard_count
+
+# 本次任务要翻译的单词：输入中属于当前分片的条目（不分片时为全部条目）
+def iter_job_words(input_file, args):
+    words = iter_input_words(input_file, args.column)
+    if args.shard_count is None:
+        return words
+    return (word for word in words if shard_of(word, args.shard_count) == args.shard_index)
+
+# 输入文件对应的输出文件名（每个目标语言一个；分片运行时带上分片编号）
+def output_file_for(input_file, args):
+    extension = OUTPUT_FORMATS[args.output_format]
+    shard = f".shard-{args.shard_index}-of-{args.shard_count}" if args.shard_count is not None else ''
+    return f"translated_{input_stem(input_file)}_{args.from_lang}_to_{args.to_lang}{shard}{extension}"
+
+# 分片清单：与分片输出放在一起，记录分片的完成状态，merge 时检查
+def write_shard_manifest(output_file, input_file, args, status, entries=None, translated=None, failed=None):
+    if args.shard_count is None:
+        return
+    manifest = {
+        'input': input_file,
+        'shard': f"{args.shard_index}/{args.shard_count}",
+        'from_lang': args.from_lang,
+        'to_lang': args.to_lang,
+        'output': output_file,
+        'output_format': args.output_format,
+        'host': platform.node(),
+        'pid': os.getpid(),
+        'updated_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'status': status,
+        'entries': entries,
+        'translated': translated,
+        'failed': failed,
+    }
+    path = output_file + '.manifest.json'
+    try:
+        with open(path + '.tmp', 'w', encoding='utf-8') as file:
+            json.dump(manifest, file, ensure_ascii=False, indent=2)
+        os.replace(path + '.tmp', path)
+    except OSError as e:
+        print(f"写入分片清单时出错: {str(e)}")
+
+# 读取分片清单，不存在或已损坏时返回 None
+def load_shard_manifest(output_file):
+    try:
+        with open(output_file + '.manifest.json', 'r', encoding='utf-8') as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+# 完成状态：没有失败条目且每个条目都有译文时为 complete
+def shard_status(entries, translated, failed):
+    return 'complete' if not failed and translated >= entries else 'incomplete'
+
+# 宽表输出文件名：所有目标语言合在一个文件中，每种语言一列
+def wide_output_file_for(input_file, args):
+    shard = f".shard-{args.shard_index}-of-{args.shard_count}" if args.shard_count is not None else ''
+    return f"translated_{input_stem(input_file)}_{args.from_lang}_to_{'-'.join(args.to_langs)}{shard}.csv"
+
+# 判断输入文件是否还有未翻译的单词（任一目标语言）；只读取不修改任何文件，读不了输入文件时交给 translate_file 报错
+def has_pending_work(input_file, args):
+    if args.stream:
+        # 流式模式只比较输入的条目数和各语言已提交的进度，不在内存中保存单词
+        try:
+            total = sum(1 for _ in iter_job_words(input_file, args))
+        except Exception:
+            return True
+        return any(
+            stream_done_lines(output_file_for(input_file, target_args(args, to_lang))) < total
+            for to_lang in args.to_langs
+        )
+    try:
+        words = list(iter_job_words(input_file, args))
+    except Exception:
+        return False
+    for to_lang in args.to_langs:
+        output_file = output_file_for(input_file, target_args(args, to_lang))
+        try:
+            done = set(read_output_keys(output_file, args.output_format))
+            done.update(source for source, _ in read_log_rows(output_file + '.log'))
+        except Exception:
+            return True
+        if any(word not in done for word in words):
+            return True
+    return False
+
+# 把各目标语言的结果合并成宽表：原文一列，每种语言一列，按输入顺序排列，缺失的译文留空
+def write_wide_csv(input_file, args, words):
+    columns = {}
+    for to_lang in args.to_langs:
+        output_file = output_file_for(input_file, target_args(args, to_lang))
+        columns[to_lang] = dict(read_output_rows(output_file, args.output_format))
+    wide_file = wide_output_file_for(input_file, args)
+    temp_file = wide_file + '.tmp'
+    try:
+        with open(temp_file, 'w', encoding='utf-8-sig', newline='') as file:
+            writer = csv.writer(file, lineterminator='\n')
+            writer.writerow(['原文'] + args.to_langs)
+            for word in words:
+                row = [columns[to_lang].get(word, '') for to_lang in args.to_langs]
+                if any(row):
+                    writer.writerow([word] + row)
+        os.replace(temp_file, wide_file)
+        print(f"宽表已保存为 {wide_file}")
+    except Exception as e:
+        print(f"保存宽表时出错: {str(e)}")
+
+# 翻译单个输入文件到所有目标语言：输入只读取一次，各语言依次使用同一个进程池/翻译器；
+# caches 为 {(源语言, 目标语言): 缓存}，pool 不为空时复用调用方的常驻进程池；无法读取输入时返回 False
+def translate_file(input_file, args, caches, pool=None):
+    if args.stream:
+        return translate_file_streaming(input_file, args, caches, pool)
+    
+    job = load_file_job(input_file, args)
+    if job is None:
+        return False
+    for to_lang in args.to_langs:
+        if len(args.to_langs) > 1:
+            print(f"\n===== {args.from_lang} → {to_lang} =====")
+        translate_file_target(job, to_lang, args, caches, pool)
+    
+    if args.output_layout == 'wide':
+        write_wide_csv(input_file, args, job['words'])
+    return True
+
+# 多个输入文件、多个目标语言：语言在外层循环，每个语言依次翻译所有文件，每个进程对每个语言只加载一次模型
+# （文件在外层时每个文件都要把所有语言的模型轮流加载一遍）。各文件只读取一次、去重一次，各语言共用；
+# 返回无法读取的输入文件
+def translate_files_by_language(input_files, args, caches, pool=None):
+    jobs = {}
+    failed = []
+    for input_file in input_files:
+        job = load_file_job(input_file, args)
+        if job is None:
+            failed.append(input_file)
+        else:
+            jobs[input_file] = job
+    for to_lang in args.to_langs:
+        print(f"\n===== {args.from_lang} → {to_lang} =====")
+        for input_file, job in jobs.items():
+            print(f"\n----- {input_file} -----")
+            translate_file_target(job, to_lang, args, caches, pool)
+    if args.output_layout == 'wide':
+        for input_file, job in jobs.items():
+            write_wide_csv(input_file, args, job['words'])
+    return failed
+
+# 读取一个输入文件（去除空白行，分片运行时只保留本分片的条目）并建立去重索引，无法读取时返回 None。
+# 中转翻译的第一段结果（源语言 → 中间语言）记在 pivot_memo 中，经同一中间语言的各目标语言共用
+def load_file_job(input_file, args):
+    try:
+        words = list(iter_job_words(input_file, args))
+        if args.shard_count is not None:
+            print(f"从 {input_file} 读取了分片 {args.shard_index}/{args.shard_count} 的 {len(words)} 个单词")
+        else:
+            print(f"从 {input_file} 读取了 {len(words)} 个单词")
+    except Exception as e:
+        print(f"读取输入文件时出错: {str(e)}")
+        return None
+    return {'input_file': input_file, 'words': words,
+            'index': DedupeIndex(words, args.normalize_rules), 'pivot_memo': {}}
+
+# 把一个已读取的输入文件翻译到一个目标语言，前后更新分片清单
+def translate_file_target(job, to_lang, args, caches, pool=None):
+    input_file, words = job['input_file'], job['words']
+    lang_args = target_args(args, to_lang)
+    output_file = output_file_for(input_file, lang_args)
+    write_shard_manifest(output_file, input_file, lang_args, 'running', len(words))
+    writer = translate_target(words, output_file, lang_args, caches or {}, pool, job['pivot_memo'], job['index'])
+    write_shard_manifest(output_file, input_file, lang_args,
+                         shard_status(len(words), writer.compacted_count, writer.failure_count),
+                         len(words), writer.compacted_count, writer.failure_count)
+
+# 把已读取的单词翻译到一个目标语言（args.to_lang），从 output_file 续跑；返回已关闭的 writer，用于统计
+# index 为各目标语言共用的去重索引
+def translate_target(words, output_file, args, caches, pool=None, pivot_memo=None, index=None):
+    # 检查是否存在已翻译的结果（已压缩的 CSV 和上次中断留下的日志）
+    writer = ResultWriter(output_file, words, args.compact_every, args.output_format)
+    try:
+        done = writer.load_done()
+        if done:
+            print(f"从 {output_file} 及其日志读取了 {len(done)} 个已翻译的单词")
+    except Exception as e:
+        print(f"读取已有翻译文件时出错: {str(e)}")
+        print("将创建新的翻译文件")
+        done = set()
     
     # 找出未翻译的单词
-    remaining_words = [word for word in words if word not in existing_translations]
+    remaining_words = [word for word in words if word not in done]
     print(f"需要翻译的单词数: {len(remaining_words)}")
     
     if not remaining_words:
+        # 上次中断在压缩之前时，把日志合并进 CSV
+        writer.close()
         print("所有单词已翻译完成！")
-        return
+        return writer
     
-    # 结果字典
-    result_dict = {}
+    # 规范化去重：每个唯一单元只翻译一次，结果扇出回每一行
+    plan = TranslationPlan(remaining_words, args.normalize_rules, writer, index)
+    units = plan.unit_texts()
+    print(f"规范化去重后需要翻译 {len(units)} 个单元（{len(plan.entries)} 个不同条目）")
+    
+    try:
+        translate_units(units, args, caches, plan, pool, pivot_memo if pivot_memo is not None else {})
+    finally:
+        # 无论正常结束、出错还是 Ctrl-C，都把已落盘的结果压缩进 CSV
+        if writer.close():
+            print(f"翻译结果已保存为 {output_file}")
+    return writer
+
+# 流式翻译单个输入文件：按 --chunk_size 分块读取，每块翻译到所有目标语言后按输入顺序追加写出并记录进度，
+# 内存占用只与块大小有关，与输入总行数无关；无法读取输入或某个语言无法续跑时返回 False
+def translate_file_streaming(input_file, args, caches, pool=None):
+    writers = {}
+    ok = True
+    for to_lang in args.to_langs:
+        writer = StreamResultWriter(output_file_for(input_file, target_args(args, to_lang)), args.output_format)
+        try:
+            writer.load_progress()
+        except (OSError, ValueError) as e:
+            print(f"无法续跑 {writer.output_file}: {str(e)}")
+            ok = False
+            continue
+        if writer.done_lines:
+            print(f"{writer.output_file} 已完成输入的前 {writer.done_lines} 个单词，从第 {writer.done_lines + 1} 个继续")
+        write_shard_manifest(writer.output_file, input_file, target_args(args, to_lang), 'running')
+        writers[to_lang] = writer
     
+    line_no = 0
+    finished = False
+    try:
+        for chunk in iter_chunks(iter_job_words(input_file, args), args.chunk_size):
+            # 中转翻译的第一段结果只在块内复用，保证内存有界
+            pivot_memo = {}
+            index = None
+            worked = False
+            for to_lang, writer in writers.items():
+                skip = writer.done_lines - line_no
+                if skip >= len(chunk):
+                    continue
+                words = chunk[max(0, skip):]
+                if len(args.to_langs) > 1:
+                    print(f"\n===== {args.from_lang} → {to_lang} =====")
+                lang_args = target_args(args, to_lang)
+                writer.begin(words)
+                if index is None:
+                    index = DedupeIndex(chunk, args.normalize_rules)
+                plan = TranslationPlan(words, args.normalize_rules, writer, index)
+                translate_units(plan.unit_texts(), lang_args, caches or {}, plan, pool, pivot_memo)
+                writer.commit(words)
+                worked = True
+            line_no += len(chunk)
+            if worked:
+                print(f"{input_file}: 已处理 {line_no} 个单词")
+        finished = True
+    except (OSError, ValueError, UnicodeDecodeError) as e:
+        print(f"读取输入文件时出错: {str(e)}")
+    finally:
+        for to_lang, writer in writers.items():
+            writer.close()
+            if finished:
+                write_shard_manifest(writer.output_file, input_file, target_args(args, to_lang),
+                                     shard_status(line_no, writer.total_rows, writer.total_failed),
+                                     line_no, writer.total_rows, writer.total_failed)
+    return ok and finished
+
+# 把一组唯一单元翻译到 args.to_lang，结果交给 plan；没有直接语言包的目标语言经中间语言中转。
+# 指定了术语表时先做术语预处理
+def translate_units(units, args, caches, plan, pool, pivot_memo):
+    glossary = getattr(args, 'glossary_index', None)
+    sink = plan
+    if glossary is not None:
+        sink = GlossarySink(plan)
+        units = apply_glossary(units, glossary, sink)
+    if units:
+        pivot_lang = getattr(args, 'pivots', {}).get(args.to_lang)
+        if pivot_lang:
+            run_pivot_translation(units, args, caches, sink, pool, pivot_lang, pivot_memo)
+        else:
+            run_translation(units, args, caches.get((args.from_lang, args.to_lang)), sink, pool)
+    if glossary is not None and sink.lost:
+        print(f"{len(sink.lost)} 个单元的术语占位符在译文中丢失，改为不保护术语重新翻译")
+        translate_units(sink.lost, argparse.Namespace(**{**vars(args), 'glossary_index': None}),
+                        caches, plan, pool, pivot_memo)
+
+# 追加写入翻译记忆的匹配报告（模糊复用的条目和给审校参考的相似条目）
+def append_fuzzy_report(path, rows):
+    with open(path, 'a', encoding='utf-8-sig', newline='') as file:
+        writer = csv.writer(file, lineterminator='\n')
+        if file.tell() == 0:
+            writer.writerow(['源语言', '目标语言', '原文', '相似原文', '相似度', '参考译文', '处理'])
+        writer.writerows(rows)
+
+# 翻译记忆预处理（--fuzzy_policy hint/reuse），在分批之前于主进程中执行：
+# 缓存中的精确命中直接交给 writer；其余单元查模糊匹配，reuse 策略下相似度达到 --fuzzy_threshold 的
+# 复用相似条目的译文、不再交给模型，相似度达到 --fuzzy_hint_threshold 的写入报告供审校参考。返回仍需翻译的单元
+def apply_translation_memory(units, args, cache, writer):
+    policy = getattr(args, 'fuzzy_policy', 'off')
+    if policy == 'off' or cache is None or not cache.fuzzy or not units:
+        return units
+    exact = cache.get_many(units)
+    if exact:
+        writer.append(exact)
+    reused = {}
+    report = []
+    remaining = []
+    start = time.perf_counter()
+    lookups = 0
+    for unit in units:
+        if unit in exact:
+            continue
+        match = cache.fuzzy_lookup(unit, args.fuzzy_hint_threshold)
+        lookups += 1
+        if match is not None and policy == 'reuse' and match[0] >= args.fuzzy_threshold:
+            reused[unit] = match[2]
+            report.append([args.from_lang, args.to_lang, unit, match[1], f"{match[0]:.3f}", match[2], '复用'])
+            continue
+        if match is not None:
+            report.append([args.from_lang, args.to_lang, unit, match[1], f"{match[0]:.3f}", match[2], '提示'])
+        remaining.append(unit)
+    elapsed = time.perf_counter() - start
+    if reused:
+        writer.append(reused)
+    if report:
+        try:
+            append_fuzzy_report(args.fuzzy_report, report)
+        except OSError as e:
+            print(f"写入翻译记忆报告时出错: {str(e)}")
+    average = f"，平均每次查询 {elapsed / lookups * 1000:.3f} 毫秒" if lookups else ""
+    print(f"翻译记忆：精确命中 {len(exact)} 个，模糊复用 {len(reused)} 个，"
+          f"相似提示 {len(report) - len(reused)} 个{average}" + (f"（见 {args.fuzzy_report}）" if report else ""))
+    return remaining
+
+# 流式模式下分桶组批的窗口大小（见 make_batches），其他模式整体分桶
+def batch_window(args):
+    return args.reorder_window if getattr(args, 'stream', False) and args.reorder_window > 0 else None
+
+# 执行翻译，结果逐批交给 writer（任何带 append 方法的结果接收者）
+def run_translation(remaining_words, args, cache, writer, pool=None):
+    remaining_words = apply_translation_memory(remaining_words, args, cache, writer)
+    if not remaining_words:
+        return
     # 选择使用多进程或多线程
     start_time = time.time()
+    start_count = writer.new_count
     
-    if args.use_mp:
+    if args.use_async:
+        # 使用异步模式，适合 HTTP 等 I/O 密集的后端
+        try:
+            concurrency = get_translator(args.from_lang, args.to_lang, args.backend).max_concurrency or args.threads
+        except Exception:
+            # 加载失败在 run_async_batches 中报告，各批次的条目记为失败
+            concurrency = args.threads
+        print(f"使用异步模式，最多 {args.max_in_flight} 个批次在途，后端并发上限: {concurrency}")
+        
+        batches = make_batches(remaining_words, args.token_budget, args.batch_size, batch_window(args))
+        print(f"按长度分桶为 {len(batches)} 个批次，每批最多 {args.batch_size} 个单词")
+        
+        asyncio.run(run_async_batches(batches, args, cache, writer))
+    elif args.use_mp:
         # 使用多进程
         print(f"使用多进程模式，进程数: {args.threads}")
         
-        # 分割任务
+        # 分割任务：单词数上限保证每个进程至少分到两个批次
         batch_size = max(1, min(args.batch_size, len(remaining_words) // (args.threads * 2) + 1))
-        batches = [remaining_words[i:i+batch_size] for i in range(0, len(remaining_words), batch_size)]
+        if batch_size < args.batch_size:
+            print(f"单词数较少，每批单词数从 {args.batch_size} 调整为 {batch_size}，保证每个进程至少分到两个批次")
+        batches = make_batches(remaining_words, args.token_budget, batch_size, batch_window(args))
         
-        print(f"分割为 {len(batches)} 个批次，每批约 {batch_size} 个单词")
+        print(f"按长度分桶为 {len(batches)} 个批次，每批最多 {batch_size} 个单词")
         
-        # 创建进程池
-        with mp.Pool(processes=args.threads) as pool:
-            # 创建并跟踪异步任务
-            tasks = []
-            for batch in batches:
-                task = pool.apply_async(translate_batch, (batch, args.from_lang, args.to_lang))
-                tasks.append(task)
-            
-            # 显示进度条
-            with tqdm(total=len(batches), desc="批次进度") as pbar:
-                completed = 0
-                while completed < len(batches):
-                    new_completed = sum(1 for task in tasks if task.ready())
-                    if new_completed > completed:
-                        pbar.update(new_completed - completed)
-                        completed = new_completed
-                    time.sleep(0.1)
-            
-            # 获取所有结果
-            for task in tasks:
-                batch_results = task.get()
-                result_dict.update(batch_results)
+        if pool is not None:
+            # 复用常驻进程池，模型已在各工作进程中加载
+            run_pool_batches(pool, batches, args, cache, writer)
+        else:
+            # 创建进程池，每个工作进程启动时预加载模型
+            with create_worker_pool(args.threads, args.from_lang, args.to_lang, args.backend, pool_cpu_sets(args), **pool_limits(args)) as own_pool:
+                run_pool_batches(own_pool, batches, args, cache, writer)
     else:
         # 使用多线程
         print(f"使用多线程模式，线程数: {args.threads}")
         
-        # 创建工作队列
-        work_queue = queue.Queue()
+        # 按长度分桶组批
+        batches = make_batches(remaining_words, args.token_budget, args.batch_size, batch_window(args))
+        print(f"按长度分桶为 {len(batches)} 个批次，每批最多 {args.batch_size} 个单词")
         
-        # 将未翻译的单词添加到工作队列
-        for word in remaining_words:
-            work_queue.put(word)
-        
-        # 创建并启动工作线程
-        threads = []
-        for _ in range(min(args.threads, len(remaining_words))):
-            thread = threading.Thread(
-                target=translate_worker, 
-                args=(work_queue, result_dict, args.from_lang, args.to_lang, args.batch_size)
-            )
-            thread.daemon = True
-            thread.start()
-            threads.append(thread)
-        
-        # 显示进度条
-        with tqdm(total=len(remaining_words), desc="翻译进度") as pbar:
-            last_done = 0
-            while work_queue.unfinished_tasks > 0:
-                current_done = len(remaining_words) - work_queue.unfinished_tasks
-                if current_done > last_done:
-                    pbar.update(current_done - last_done)
-                    last_done = current_done
-                time.sleep(0.1)
-        
-        # 等待所有线程完成
-        for thread in threads:
-            thread.join()
+        run_thread_batches(batches, args, cache, writer)
     
     # 计算翻译速度
     translation_time = time.time() - start_time
-    words_per_second = len(result_dict) / translation_time if translation_time > 0 else 0
+    words_per_second = (writer.new_count - start_count) / translation_time if translation_time > 0 else 0
     print(f"\n翻译完成! 用时: {translation_time:.2f}秒, 速度: {words_per_second:.2f}词/秒")
+
+# 收集一段翻译结果的接收者，中转翻译的第一段使用
+class CollectingSink:
+    def __init__(self):
+        self.results = {}
+        self.failures = {}
+        self._lock = threading.Lock()
+
+    @property
+    def new_count(self):
+        return len(self.results)
+
+    def append(self, results, failures=None):
+        with self._lock:
+            self.results.update(results)
+            self.failures.update(failures or {})
+
+# 中转翻译第二段的接收者：把中间语言文本的译文扇出给对应的原始单元
+class PivotSink:
+    def __init__(self, plan, units_by_intermediate):
+        self.plan = plan
+        self.units_by_intermediate = units_by_intermediate
+
+    @property
+    def new_count(self):
+        return self.plan.new_count
+
+    def append(self, results, failures=None):
+        unit_results = {}
+        unit_failures = {}
+        for intermediate, translation in results.items():
+            for unit in self.units_by_intermediate.get(intermediate, []):
+                unit_results[unit] = translation
+        for intermediate, error in (failures or {}).items():
+            for unit in self.units_by_intermediate.get(intermediate, []):
+                unit_failures[unit] = error
+        self.plan.append(unit_results, unit_failures)
+
+# 术语保护的接收者：把带占位符文本的译文换回术语后扇出给对应的原始单元，不含术语的单元原样转交；
+# 占位符在译文中丢失的单元记在 lost 中，由调用方不保护术语重新翻译
+class GlossarySink:
+    def __init__(self, plan):
+        self.plan = plan
+        self.units_by_masked = {}   # 带占位符的文本 -> [(原始单元, 占位符对应的译文)]
+        self.plain = set()          # 不含术语、原样翻译的单元
+        self.lost = []
+
+    @property
+    def new_count(self):
+        return self.plan.new_count
+
+    def register(self, masked, unit, replacements):
+        self.units_by_masked.setdefault(masked, []).append((unit, replacements))
+
+    def append(self, results, failures=None):
+        unit_results = {}
+        unit_failures = {}
+        for text, translation in results.items():
+            if text in self.plain:
+                unit_results[text] = translation
+            for unit, replacements in self.units_by_masked.get(text, []):
+                restored = restore_placeholders(translation, replacements)
+                if restored is None:
+                    self.lost.append(unit)
+                else:
+                    unit_results[unit] = restored
+        for text, error in (failures or {}).items():
+            if text in self.plain:
+                unit_failures[text] = error
+            for unit, _ in self.units_by_masked.get(text, []):
+                unit_failures[unit] = error
+        self.plan.append(unit_results, unit_failures)
+
+# 术语预处理，在查缓存和分批之前执行：整条都是术语的单元直接输出，不经过模型；
+# 含有术语的单元把术语换成占位符后再翻译（相同的带占位符文本只翻译一次）。返回需要交给模型的文本
+def apply_glossary(units, glossary, sink):
+    direct = {}
+    remaining = []
+    protected = 0
+    for unit in units:
+        masked, replacements = glossary.protect(unit)
+        if masked is None:
+            sink.plain.add(unit)
+            remaining.append(unit)
+            continue
+        if not re.search(r'\w', _placeholder_pattern.sub('', masked)):
+            # 除了术语只剩空白和标点（例如 "CI/CD"）
+            direct[unit] = restore_placeholders(masked, replacements)
+            continue
+        if masked not in sink.units_by_masked and masked not in sink.plain:
+            remaining.append(masked)
+        sink.register(masked, unit, replacements)
+        protected += 1
+    if direct:
+        sink.plan.append(direct)
+    print(f"术语表：{len(direct)} 个单元整条命中术语、不经过模型，{protected} 个单元中的术语已保护")
+    return remaining
+
+# 经中间语言中转翻译：源语言 → 中间语言 → 目标语言，两段各用自己语言对的缓存。
+# 第一段的结果记在 pivot_memo 中，同一输入文件里经同一中间语言的其他目标语言直接复用；
+# 跨运行时则由第一段的缓存复用
+def run_pivot_translation(units, args, caches, plan, pool, pivot_lang, pivot_memo):
+    memo = pivot_memo.setdefault((args.from_lang, pivot_lang), {})
+    pending = [unit for unit in units if unit not in memo]
+    if pending:
+        print(f"第一段：{args.from_lang} → {pivot_lang}，{len(pending)} 个单元")
+        first_leg = CollectingSink()
+        run_translation(pending, target_args(args, pivot_lang),
+                        caches.get((args.from_lang, pivot_lang)), first_leg, pool)
+        memo.update(first_leg.results)
+        if first_leg.failures:
+            plan.append({}, first_leg.failures)
+    else:
+        print(f"第一段：{args.from_lang} → {pivot_lang} 的结果已在本次运行中得到，直接复用")
     
-    # 合并已翻译的结果和新翻译的结果
-    all_translations = existing_translations.copy()
-    all_translations.update(result_dict)
+    # 不同的原文可能得到相同的中间译文，第二段只翻译一次
+    units_by_intermediate = {}
+    for unit in units:
+        if unit in memo:
+            units_by_intermediate.setdefault(memo[unit], []).append(unit)
+    if not units_by_intermediate:
+        return
+    print(f"第二段：{pivot_lang} → {args.to_lang}，{len(units_by_intermediate)} 个单元")
+    second_args = argparse.Namespace(**{**vars(args), 'from_lang': pivot_lang})
+    run_translation(list(units_by_intermediate), second_args,
+                    caches.get((pivot_lang, args.to_lang)), PivotSink(plan, units_by_intermediate), pool)
+
+# --auto：读取已记录的配置档案，没有时用第一个输入文件试跑校准，然后覆盖命令行中的线程/批次/模式设置
+def apply_auto_profile(args):
+    key = profile_key(args)
+    profile = None if args.recalibrate else load_profile(args.profile_file, key)
+    if profile is not None:
+        print(f"使用已记录的配置档案 ({args.profile_file})")
+    else:
+        try:
+            # 只读取输入的开头部分作为样本来源，超大的输入也不会整个读入内存
+            words = list(itertools.islice(iter_input_words(args.input_file[0], args.column), args.auto_sample * 100))
+        except Exception as e:
+            print(f"读取输入文件时出错: {str(e)}，不做自动调优")
+            return
+        profile = auto_tune(words, args)
+        # 试跑时加载的翻译器按试跑配置分配线程，正式运行前丢弃
+        release_translators()
+        if profile is None:
+            print("输入为空，不做自动调优")
+            return
+        try:
+            save_profile(args.profile_file, key, profile)
+            print(f"配置档案已保存到 {args.profile_file}")
+        except OSError as e:
+            print(f"保存配置档案时出错: {str(e)}")
     
-    # 创建 DataFrame，保持原始单词顺序
-    data = []
-    for word in words:
-        if word in all_translations:
-            data.append((word, all_translations[word]))
+    args.threads = profile['threads']
+    args.batch_size = profile['batch_size']
+    args.use_mp = profile['use_mp']
+    mode = '多进程' if args.use_mp else '多线程'
+    print(f"自动调优结果：{mode}，数量 {args.threads}，每批最多 {args.batch_size} 个单词"
+          f"（试跑 {profile['words_per_sec']} 词/秒）")
+
+# 兼容 LibreTranslate 接口的本地翻译服务：把 /translate 请求交给本地后端翻译
+# 使用 HTTP/1.1 长连接，同一连接上流水线发来的请求会按顺序处理；
+# 返回已绑定地址、尚未启动的服务器，端口为 0 时由系统分配（见 server.server_address）。
+# idle_timeout 不为空时，连接空闲超过该秒数由服务器关闭
+def make_libretranslate_server(address, backend, idle_timeout=None):
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    
+    class LibreTranslateHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        timeout = idle_timeout
+        
+        def _send_json(self, status, payload):
+            body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        
+        def do_GET(self):
+            if self.path.rstrip('/') == '/languages':
+                self._send_json(200, [])
+            else:
+                self._send_json(404, {'error': 'Not Found'})
+        
+        def do_POST(self):
+            raw = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            if self.path.rstrip('/') != '/translate':
+                self._send_json(404, {'error': 'Not Found'})
+                return
+            try:
+                if self.headers.get('Content-Type', '').startswith('application/json'):
+                    payload = json.loads(raw)
+                else:
+                    payload = {key: value if len(value) > 1 else value[0]
+                               for key, value in urllib.parse.parse_qs(raw.decode('utf-8')).items()}
+                texts, source, target = payload['q'], payload['source'], payload['target']
+            except (ValueError, KeyError) as e:
+                self._send_json(400, {'error': f"请求格式错误: {str(e)}"})
+                return
+            try:
+                outputs = get_translator(source, target, backend).translate_segments(
+                    texts if isinstance(texts, list) else [texts]
+                )
+            except Exception as e:
+                self._send_json(500, {'error': str(e)})
+                return
+            self._send_json(200, {'translatedText': outputs if isinstance(texts, list) else outputs[0]})
+        
+        def log_message(self, format, *args):
+            pass
+    
+    host, _, port = address.rpartition(':')
+    server = ThreadingHTTPServer((host or '127.0.0.1', int(port)), LibreTranslateHandler)
+    server.daemon_threads = True
+    return server
+
+# 启动本地翻译服务，直到 Ctrl-C
+def serve_libretranslate(address, backend):
+    server = make_libretranslate_server(address, backend)
+    host, port = server.server_address[:2]
+    print(f"翻译服务已启动: http://{host}:{port}/translate，后端: {backend}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("翻译服务已停止")
+    finally:
+        server.server_close()
+
+# 合并一个输入文件、一个目标语言的所有分片：按输入顺序逐条从对应分片的输出中取译文（各分片的输出
+# 本身按输入顺序排列），边读边写，内存占用与输入大小无关；同时核对每个输入条目都有译文
+def merge_shard_outputs(input_file, args):
+    final_file = output_file_for(input_file, argparse.Namespace(**{**vars(args), 'shard_count': None}))
+    shard_files = [
+        output_file_for(input_file, argparse.Namespace(**{**vars(args), 'shard_index': i}))
+        for i in range(args.shard_count)
+    ]
+    print(f"\n合并 {input_file} 的 {args.shard_count} 个分片 ({args.from_lang} → {args.to_lang}):")
+    for path in shard_files:
+        manifest = load_shard_manifest(path)
+        if manifest is None:
+            state = '没有分片清单' if os.path.exists(path) else '没有输出'
+        else:
+            state = f"{manifest['status']}，{manifest.get('translated')}/{manifest.get('entries')} 条，" \
+                    f"失败 {manifest.get('failed')} 条（{manifest.get('host')}，{manifest.get('updated_at')}）"
+        print(f"  {path}: {state}")
+    
+    readers = [iter(read_output_rows(path, args.output_format)) for path in shard_files]
+    heads = [next(reader, None) for reader in readers]
+    missing = collections.Counter()
+    examples = []
     
-    df = pd.DataFrame(data, columns=['原文', '翻译'])
+    def merged_rows():
+        for word in iter_input_words(input_file, args.column):
+            index = shard_of(word, args.shard_count)
+            if heads[index] is not None and heads[index][0] == word:
+                yield heads[index]
+                heads[index] = next(readers[index], None)
+            else:
+                missing[index] += 1
+                if len(examples) < 10:
+                    examples.append(word)
     
-    # 保存为 CSV 文件
+    temp_file = final_file + '.tmp'
     try:
-        df.to_csv(output_file, index=False, encoding='utf-8-sig')
-        print(f"翻译完成，已保存为 {output_file}")
+        count = write_output_rows(temp_file, args.output_format, merged_rows())
     except Exception as e:
-        print(f"保存翻译结果时出错: {str(e)}")
+        print(f"合并时出错: {str(e)}")
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+        return False
+    # 分片输出中没有对上的行说明输入在分片运行之后被修改过
+    extra = sum(1 for head in heads if head is not None) + sum(sum(1 for _ in reader) for reader in readers)
+    
+    if missing or extra:
+        for index, number in sorted(missing.items()):
+            print(f"  分片 {index}/{args.shard_count} 缺少 {number} 条译文")
+        if examples:
+            print(f"  缺少译文的条目示例: {', '.join(examples)}")
+        if extra:
+            print(f"  分片输出中有 {extra} 行与输入对不上，输入可能在分片运行之后被修改过")
+        if not args.allow_partial:
+            os.remove(temp_file)
+            print(f"  覆盖不完整，没有生成 {final_file}（可以补跑对应分片，或用 --allow_partial 生成不完整的结果）")
+            return False
+    os.replace(temp_file, final_file)
+    print(f"  已合并 {count} 行，结果保存为 {final_file}")
+    return not missing and not extra
+
+# merge 子命令：python batch_translate.py merge <输入文件> ... --shards N
+def merge_main(argv):
+    parser = argparse.ArgumentParser(prog='batch_translate.py merge', description='按输入顺序合并分片翻译的结果并核对覆盖率')
+    parser.add_argument('input_file', type=str, nargs='+', help='分片运行时使用的输入文件')
+    parser.add_argument('--shards', type=int, required=True, help='分片总数 N')
+    parser.add_argument('--from_lang', type=str, default='en', help='源语言代码 (默认: en)')
+    parser.add_argument('--to_lang', type=str, default='zh', help='目标语言代码，多个语言用逗号分隔 (默认: zh)')
+    parser.add_argument('--output_format', type=str, default='csv', choices=list(OUTPUT_FORMATS), help='分片输出和合并结果的格式 (默认: csv)')
+    parser.add_argument('--column', type=str, default=None, help='CSV/TSV 输入的列名或序号，JSONL 输入的字段名')
+    parser.add_argument('--allow_partial', action='store_true', help='有条目缺少译文时仍然生成合并结果')
+    args = parser.parse_args(argv)
+    if args.shards < 1:
+        parser.error('--shards 必须大于 0')
+    try:
+        to_langs = parse_target_langs(args.to_lang)
+    except ValueError as e:
+        parser.error(str(e))
+    args.shard_count = args.shards
+    args.shard_index = 0
+    
+    ok = True
+    for input_file in args.input_file:
+        for to_lang in to_langs:
+            ok = merge_shard_outputs(input_file, target_args(args, to_lang)) and ok
+    if not ok:
+        sys.exit(1)
+
+# 第一个目标语言最先用到的模型（经中转时为第一段），用于预加载
+def first_leg_langs(args):
+    pivot_lang = args.pivots.get(args.to_lang)
+    return args.from_lang, pivot_lang or args.to_lang
+
+# 进程池的绑核方案
+def pool_cpu_sets(args):
+    budget = getattr(args, 'thread_budget', None)
+    return budget['cpu_sets'] if budget else None
+
+# 进程池的内存限制和回收策略；--use_mp 运行时进程池启动后总是打印各进程的内存构成
+def pool_limits(args):
+    return {'max_tasks': args.max_tasks_per_worker, 'max_rss_mb': args.worker_max_rss, 'max_memory_mb': args.max_memory,
+            'report_memory': True}
+
+# 按当前的线程/进程设置规划并应用线程预算；只对在本机推理的后端生效
+def setup_thread_budget(args):
+    if not args.in_process_backend:
+        args.thread_budget = None
+        return
+    budget = plan_thread_budget(args.device_type, args.threads, args.use_mp, args.pin_cpus)
+    if args.use_mp and budget['workers'] < args.threads:
+        print(f"进程数 {args.threads} 超过可用核心数，调整为 {budget['workers']}")
+        args.threads = budget['workers']
+    if args.pin_cpus and not budget['cpu_sets']:
+        print("绑定 CPU 只在 CPU 推理的多进程模式下、且系统支持 sched_setaffinity 时生效")
+    apply_thread_budget(budget)
+    describe_thread_budget(budget)
+    args.thread_budget = budget
+
+# 依次翻译所有输入文件，返回无法读取（或无法续跑）的输入文件
+def run_input_files(args, caches):
+    # 各目标语言依次翻译，每个进程（主进程和工作进程）同一时间只保留当前语言的模型
+    use_single_translator()
+    if args.use_mp and (args.persistent_pool or args.stream or len(args.to_langs) > 1):
+        # 整个运行期间共用一个常驻进程池；多个目标语言时，各工作进程遇到下一个语言的批次时
+        # 释放上一个语言的模型再加载新的，进程池的内存占用与只翻译一种语言时相同
+        print(f"创建常驻进程池，进程数: {args.threads}")
+        with create_worker_pool(args.threads, *first_leg_langs(args), args.backend, pool_cpu_sets(args), **pool_limits(args)) as pool:
+            args.threads = pool.processes
+            failed = translate_input_files(args, caches, pool)
+    else:
+        if not args.use_mp:
+            # 多线程模式下所有线程共享同一个翻译器，提前加载一次
+            try:
+                get_translator(*first_leg_langs(args), args.backend).warm_up()
+            except Exception as e:
+                print(f"预加载模型时出错: {str(e)}")
+        failed = translate_input_files(args, caches)
+    return failed
+
+# 按文件或按语言依次翻译所有输入文件，返回未能完成的输入文件
+def translate_input_files(args, caches, pool=None):
+    if not args.stream and len(args.input_file) > 1 and len(args.to_langs) > 1:
+        return translate_files_by_language(args.input_file, args, caches, pool)
+    return [input_file for input_file in args.input_file if not translate_file(input_file, args, caches, pool)]
+
+# 有输入文件无法读取时以非零状态退出（其他输入文件照常翻译），方便定时任务发现问题
+def exit_on_failed_inputs(failed):
+    if failed:
+        print(f"错误：{len(failed)} 个输入文件未能完成: {', '.join(failed)}")
+        sys.exit(1)
+
+# 主函数
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == 'merge':
+        merge_main(sys.argv[2:])
+        return
+    
+    # 解析命令行参数
+    args = parse_arguments()
+    try:
+        args.normalize_rules = parse_normalize_rules(args.normalize)
+    except ValueError as e:
+        print(f"错误：{str(e)}")
+        sys.exit(1)
+    try:
+        args.to_langs = parse_target_langs(args.to_lang)
+    except ValueError as e:
+        print(f"错误：{str(e)}")
+        sys.exit(1)
+    args.glossary_index = None
+    if args.glossary or args.keep_acronyms:
+        try:
+            args.glossary_index = load_glossary(args.glossary, args.keep_acronyms)
+        except (OSError, UnicodeDecodeError, csv.Error) as e:
+            print(f"读取术语表时出错: {str(e)}")
+            sys.exit(1)
+        print(f"术语表共 {len(args.glossary_index)} 个术语" + ("，全大写的缩写保持原样" if args.keep_acronyms else ""))
+    # 需要单个目标语言的地方（自动调优、预加载）使用第一个
+    args.to_lang = args.to_langs[0]
+    
+    if args.output_format == 'parquet':
+        try:
+            import pyarrow.parquet
+        except ImportError:
+            print("错误：输出 Parquet 需要安装 pyarrow: pip install pyarrow")
+            sys.exit(1)
+    
+    # 快速路径：所有输入文件都已翻译完成时，不检查环境、不加载模型、不打开缓存，直接结束
+    if not args.serve and not any(has_pending_work(input_file, args) for input_file in args.input_file):
+        failed = []
+        for input_file in args.input_file:
+            if args.stream:
+                # 流式输出每块都已落盘，没有需要合并的日志
+                print(f"{input_file}: 所有单词已翻译完成！")
+            elif not translate_file(input_file, args, None):
+                failed.append(input_file)
+        exit_on_failed_inputs(failed)
+        return
+    
+    env = {'packages': {}} if args.refresh_env else load_env_cache(args.env_cache_file)
+    
+    # 本机推理的后端需要检测设备并分配线程预算，必须在加载模型之前完成
+    args.in_process_backend = parse_backend_spec(args.backend)[0] in ('argos', 'ct2')
+    if args.in_process_backend:
+        args.device_type = cached_device(env, args.refresh_env) if args.device == 'auto' else args.device
+        setup_thread_budget(args)
+    
+    if parse_backend_spec(args.backend)[0] == 'argos':
+        # 检查GPU状态：导入 PyTorch 较慢，只在刷新环境缓存时检查
+        if args.refresh_env or env.get('dirty'):
+            check_gpu_status()
         
-        # 尝试保存到备份文件
-        backup_file = f"backup_{output_file}"
+        # 检查并安装每个目标语言的翻译包，没有直接的语言包时经中间语言中转
+        args.pivots, model_versions = plan_translation_routes(args.from_lang, args.to_langs, args.pivot_lang, env)
+    
+    if env.pop('dirty', False):
+        save_env_cache(args.env_cache_file, env)
+    
+    if args.serve:
+        serve_libretranslate(args.serve, args.backend)
+        return
+    
+    if parse_backend_spec(args.backend)[0] != 'argos':
+        # 其他后端不需要本地翻译包，用模型标识区分缓存，语言对由后端自行处理，不做中转
+        args.pivots = {}
+        model_versions = {(args.from_lang, to_lang): backend_identity(args.backend) for to_lang in args.to_langs}
+    
+    # 打开持久化翻译缓存（同一个数据库文件，每个语言对一个视图；中转翻译的两段各有自己的视图）
+    caches = {}
+    if not args.no_cache:
         try:
-            df.to_csv(backup_file, index=False, encoding='utf-8-sig')
-            print(f"已保存备份文件: {backup_file}")
-        except:
-            print("无法保存备份文件，请检查磁盘空间和权限")
+            for (from_lang, to_lang), version in model_versions.items():
+                caches[(from_lang, to_lang)] = TranslationCache(args.cache_file, from_lang, to_lang,
+                                                                version, args.cache_max_entries)
+            print(f"使用翻译缓存: {args.cache_file}")
+            if args.fuzzy_policy != 'off':
+                for cache in caches.values():
+                    cache.enable_fuzzy()
+        except sqlite3.Error as e:
+            print(f"打开翻译缓存时出错: {str(e)}，本次不使用缓存")
+            caches = {}
+    if args.fuzzy_policy != 'off' and not caches:
+        print("--fuzzy_policy 需要持久化翻译缓存，本次不做模糊匹配")
+    
+    if args.auto:
+        apply_auto_profile(args)
+        # 自动调优可能改变了工作数和模式，重新分配线程预算
+        setup_thread_budget(args)
+    
+    # 性能指标在自动调优之后才开始记录，不包含试跑的批次
+    args.metrics = None
+    if args.metrics_trace or args.metrics_prom:
+        try:
+            args.metrics = MetricsRecorder(args.metrics_trace, args.metrics_prom, args.metrics_interval)
+        except OSError as e:
+            print(f"打开指标文件时出错: {str(e)}，本次不记录性能指标")
+    try:
+        failed = run_input_files(args, caches)
+    finally:
+        if args.metrics is not None:
+            args.metrics.close()
+        # 工作进程各自只按自己的写入量检查淘汰，结束时在主进程中再检查一次，保证缓存不超过容量
+        for cache in caches.values():
+            try:
+                cache.evict()
+            except sqlite3.Error as e:
+                print(f"淘汰翻译缓存条目时出错: {str(e)}")
+                break
+    exit_on_failed_inputs(failed)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,277 @@
+"""
+batch_translate_bench.py
+
+功能：
+该脚本用于对 batch_translate.py 的多线程和多进程翻译流水线做可复现的吞吐量基准测试。
+默认使用不加载模型的假翻译器（按 token 数模拟耗时），安装了 Argos Translate 时也可以测试真实模型。
+脚本会遍历 模式 × 线程/进程数 × 每批单词数 的组合，每个组合在独立的子进程中运行（保证峰值内存互不影响），
+最后输出一份机器可读的 JSON 报告，包含 词/秒、批次延迟 p50/p99 和峰值内存。
+
+使用方法：
+   python batch_translate_bench.py [--input <单词文件>] [--words <合成单词数>] [--backends fake,argos]
+                                   [--modes thread,process,async] [--threads 1,2,4] [--batch_sizes 10,20,40]
+                                   [--token_budget <每批 token 预算>] [--report <报告文件>]
+
+   示例：
+   python batch_translate_bench.py --threads 1,4,8 --batch_sizes 10,40 --fake_token_ms 0.2 --report bench.json
+
+参数说明：
+- --input：用于测试的单词文件，不指定时按 --seed 生成长度不一的合成词表。
+- --words：合成词表的单词数，默认为 2000。
+- --seed：合成词表的随机种子，默认为 42。
+- --backends：要测试的后端，逗号分隔，默认为 fake；argos 在未安装 Argos Translate 时自动跳过。
+- --fake_token_ms / --fake_batch_ms：假翻译器每 token 的延迟和每批的固定开销（毫秒）。
+- --modes：要测试的执行模式，thread、process 和/或 async（与 batch_translate.py 的 --use_mp、--async 对应）。
+  每个组合都通过 batch_translate.run_translation 运行，组批、重试和结果交付与正式翻译相同，只是结果不写文件。
+- --threads：要测试的线程/进程数列表。
+- --batch_sizes：要测试的每批单词数上限列表。
+- --token_budget：每批的 token 预算，默认为 160。
+- --repeat：每个组合重复运行的次数，默认为 1。
+- --report：JSON 报告的输出路径，默认为 bench_report.json。
+"""
+import argparse
+import importlib.util
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+
+import batch_translate as bt
+
+try:
+    import resource  # 仅 Unix 可用
+except ImportError:
+    resource = None
+
+# 合成词表使用的音节
+SYLLABLES = ['ba', 'co', 'de', 'fi', 'gu', 'ha', 'ji', 'ko', 'lu', 'ma', 'ne', 'po', 'ra', 'si', 'tu', 'vy', 'wo', 'ze']
+
+# 解析命令行参数
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='batch_translate.py 吞吐量基准测试')
+    parser.add_argument('--input', type=str, default=None, help='测试用的单词文件 (默认: 合成词表)')
+    parser.add_argument('--words', type=int, default=2000, help='合成词表的单词数 (默认: 2000)')
+    parser.add_argument('--seed', type=int, default=42, help='合成词表的随机种子 (默认: 42)')
+    parser.add_argument('--backends', type=str, default='fake', help='要测试的后端，逗号分隔: fake,argos (默认: fake)')
+    parser.add_argument('--fake_token_ms', type=float, default=0.5, help='假翻译器每 token 的延迟毫秒数 (默认: 0.5)')
+    parser.add_argument('--fake_batch_ms', type=float, default=2.0, help='假翻译器每批的固定开销毫秒数 (默认: 2)')
+    parser.add_argument('--modes', type=str, default='thread,process', help='执行模式，逗号分隔 (默认: thread,process)')
+    parser.add_argument('--threads', type=str, default='1,2,4', help='线程/进程数列表 (默认: 1,2,4)')
+    parser.add_argument('--batch_sizes', type=str, default='10,20,40', help='每批单词数上限列表 (默认: 10,20,40)')
+    parser.add_argument('--token_budget', type=int, default=160, help='每批的 token 预算 (默认: 160)')
+    parser.add_argument('--from_lang', type=str, default='en', help='源语言代码 (默认: en)')
+    parser.add_argument('--to_lang', type=str, default='zh', help='目标语言代码 (默认: zh)')
+    parser.add_argument('--repeat', type=int, default=1, help='每个组合重复运行的次数 (默认: 1)')
+    parser.add_argument('--report', type=str, default='bench_report.json', help='JSON 报告路径 (默认: bench_report.json)')
+    parser.add_argument('--run_one', type=str, default=None, help=argparse.SUPPRESS)  # 子进程内部使用
+    return parser.parse_args()
+
+# 生成长度不一的合成词表，同一个种子总是得到同一份词表
+def make_synthetic_words(count, seed):
+    rng = random.Random(seed)
+    words = []
+    for _ in range(count):
+        # 大多数是短术语，少数是长短语，接近真实词汇表的分布
+        n_words = rng.choices([1, 2, 3, 4, 6], weights=[40, 30, 15, 10, 5])[0]
+        words.append(' '.join(
+            ''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(1, 3))).capitalize()
+            for _ in range(n_words)
+        ))
+    return words
+
+# 读取测试用的单词
+def load_words(config):
+    if config['input']:
+        with open(config['input'], 'r', encoding='utf-8') as file:
+            return [line.strip() for line in file if line.strip()]
+    return make_synthetic_words(config['words'], config['seed'])
+
+# 计算分位数（最近秩法）
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+# 峰值内存（MB）：本进程和已结束子进程中的最大值
+def peak_rss_mb():
+    if resource is None:
+        return None, None
+    # Linux 上 ru_maxrss 以 KB 为单位，macOS 上以字节为单位
+    scale = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    self_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+    children_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale
+    return round(self_rss, 1), round(children_rss, 1)
+
+# 只计数的结果接收者：run_translation 把结果交给它而不是写文件
+class CountingWriter:
+    def __init__(self):
+        self.new_count = 0
+        self.failed = 0
+
+    def append(self, results, failures=None):
+        self.new_count += len(results)
+        self.failed += len(failures or {})
+
+# 收集每批耗时的指标记录器，由 run_translation 在每批交付时调用
+class LatencyRecorder:
+    def __init__(self):
+        self.latencies = []
+
+    def record(self, trace, from_lang, to_lang):
+        if 'total' in trace:
+            self.latencies.append(trace['total'])
+
+# 按组合构造 batch_translate.py 的参数，与命令行运行时相同
+def build_translate_args(config):
+    argv = ['<bench>', '--backend', config['backend'], '--from_lang', config['from_lang'],
+            '--to_lang', config['to_lang'], '--threads', str(config['threads']),
+            '--batch_size', str(config['batch_size']), '--token_budget', str(config['token_budget']),
+            '--device', 'cpu', '--no_cache']
+    if config['mode'] == 'process':
+        argv.append('--use_mp')
+    elif config['mode'] == 'async':
+        argv.append('--async')
+    args = bt.parse_arguments(argv)
+    args.normalize_rules = bt.parse_normalize_rules(args.normalize)
+    args.to_langs = [args.to_lang]
+    args.glossary_index = None
+    args.pivots = {}
+    args.in_process_backend = bt.parse_backend_spec(args.backend)[0] in ('argos', 'ct2')
+    args.device_type = args.device
+    bt.setup_thread_budget(args)
+    return args
+
+# 在子进程中运行一个组合，返回结果字典：驱动真实的 run_translation，结果交给只计数的 writer
+def run_one(config):
+    words = load_words(config)
+    args = build_translate_args(config)
+    backend = config['backend']
+    recorder = LatencyRecorder()
+    args.metrics = recorder
+    writer = CountingWriter()
+
+    if config['mode'] == 'process':
+        # 进程池创建时完成模型预热，不计入计时
+        with bt.create_worker_pool(args.threads, args.from_lang, args.to_lang, backend,
+                                   bt.pool_cpu_sets(args), **bt.pool_limits(args)) as pool:
+            start = time.perf_counter()
+            bt.run_translation(words, args, None, writer, pool)
+            seconds = time.perf_counter() - start
+            # 等工作进程退出并被回收后，RUSAGE_CHILDREN 才包含它们的峰值内存
+            pool.close()
+            pool.join()
+    else:
+        bt.get_translator(args.from_lang, args.to_lang, backend).warm_up()
+        start = time.perf_counter()
+        bt.run_translation(words, args, None, writer)
+        seconds = time.perf_counter() - start
+    latencies = recorder.latencies
+    translated = writer.new_count
+    failed = writer.failed
+
+    self_rss, children_rss = peak_rss_mb()
+    return {
+        'backend': backend,
+        'mode': config['mode'],
+        'threads': config['threads'],
+        'batch_size': config['batch_size'],
+        'token_budget': config['token_budget'],
+        'words': len(words),
+        'batches': len(latencies),
+        'translated': translated,
+        'failed': failed,
+        'seconds': round(seconds, 4),
+        'words_per_sec': round(len(words) / seconds, 2) if seconds > 0 else None,
+        'batch_latency_p50_ms': round(percentile(latencies, 50) * 1000, 3) if latencies else None,
+        'batch_latency_p99_ms': round(percentile(latencies, 99) * 1000, 3) if latencies else None,
+        'peak_rss_mb': self_rss,
+        'peak_worker_rss_mb': children_rss,
+    }
+
+# 生成所有待测组合
+def build_configs(args):
+    backends = []
+    for name in [b.strip() for b in args.backends.split(',') if b.strip()]:
+        if name == 'fake':
+            backends.append(f"fake:token_ms={args.fake_token_ms},batch_ms={args.fake_batch_ms}")
+        elif name == 'argos':
+            if importlib.util.find_spec('argostranslate') is None:
+                print("未安装 argostranslate，跳过 argos 后端")
+                continue
+            bt.install_translation_package(args.from_lang, args.to_lang)
+            backends.append('argos')
+        else:
+            backends.append(name)
+
+    configs = []
+    for backend in backends:
+        for mode in [m.strip() for m in args.modes.split(',') if m.strip()]:
+            for threads in [int(t) for t in args.threads.split(',') if t.strip()]:
+                for batch_size in [int(b) for b in args.batch_sizes.split(',') if b.strip()]:
+                    for _ in range(args.repeat):
+                        configs.append({
+                            'backend': backend,
+                            'mode': mode,
+                            'threads': threads,
+                            'batch_size': batch_size,
+                            'token_budget': args.token_budget,
+                            'from_lang': args.from_lang,
+                            'to_lang': args.to_lang,
+                            'input': args.input,
+                            'words': args.words,
+                            'seed': args.seed,
+                        })
+    return configs
+
+# 主函数
+def main():
+    args = parse_arguments()
+
+    if args.run_one:
+        # 子进程：运行单个组合，把结果以 JSON 打印到最后一行
+        print(json.dumps(run_one(json.loads(args.run_one)), ensure_ascii=False))
+        return
+
+    configs = build_configs(args)
+    print(f"共 {len(configs)} 个组合")
+    results = []
+    for index, config in enumerate(configs, 1):
+        label = f"{config['backend']} {config['mode']} threads={config['threads']} batch_size={config['batch_size']}"
+        completed = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--run_one', json.dumps(config)],
+            capture_output=True, text=True, encoding='utf-8'
+        )
+        lines = completed.stdout.strip().splitlines()
+        try:
+            result = json.loads(lines[-1])
+        except (IndexError, ValueError):
+            print(f"[{index}/{len(configs)}] {label} 运行失败:\n{completed.stderr}")
+            continue
+        results.append(result)
+        print(f"[{index}/{len(configs)}] {label}: {result['words_per_sec']} 词/秒, "
+              f"p50 {result['batch_latency_p50_ms']} ms, p99 {result['batch_latency_p99_ms']} ms, "
+              f"峰值内存 {result['peak_rss_mb']} MB")
+
+    report = {
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'results': results,
+    }
+    with open(args.report, 'w', encoding='utf-8') as file:
+        json.dump(report, file, ensure_ascii=False, indent=2)
+
+    if results:
+        best = max(results, key=lambda r: r['words_per_sec'] or 0)
+        print(f"\n最快组合: {best['backend']} {best['mode']} threads={best['threads']} "
+              f"batch_size={best['batch_size']}，{best['words_per_sec']} 词/秒")
+    print(f"报告已保存为 {args.report}")
+
+if __name__ == "__main__":
+    main()